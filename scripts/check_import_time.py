@@ -0,0 +1,66 @@
+"""Import-time budget check for the training and scoring entry points.
+
+Each module is imported in a fresh interpreter, best of ``--repeat`` runs. The
+check fails when an import takes longer than its budget or loads one of the
+heavy libraries the entry point is not supposed to touch at import time.
+Exits with status 1 on any violation, ``test_import_time.py`` runs the same
+check under pytest.
+
+Usage
+    python check_import_time.py
+    python -m pytest test_import_time.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY = ('pandas', 'sklearn', 'scipy', 'matplotlib', 'seaborn')
+
+# module -> import-time budget in seconds, none of them may load a HEAVY library at import time
+BUDGETS = {
+    'scoring': 0.5,
+    'serve': 1.0,
+    'score_batch': 0.5,
+    'contraceptive_method_choice': 0.5,
+}
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(module, repeat=3):
+    """ Best import time of ``module`` and the heavy libraries it loaded """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY)],
+            cwd=HERE, check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return min(run['elapsed'] for run in runs), runs[0]['loaded']
+
+
+def main(repeat=3):
+    failures = 0
+    for module, budget in BUDGETS.items():
+        elapsed, loaded = measure(module, repeat)
+        ok = elapsed <= budget and not loaded
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':<5} {module:<28} {elapsed * 1000:7.1f} ms (budget {budget * 1000:.0f} ms)"
+              + (f' loads {loaded}' if loaded else ''))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    sys.exit(1 if main(parser.parse_args().repeat) else 0)
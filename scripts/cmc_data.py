@@ -0,0 +1,97 @@
+"""Shared dataset schema for the contraceptive method choice scripts.
+
+Column names follow ``headers`` in ``contraceptive_method_choice.py`` and the
+value domains follow section 7 of ``data/cmc.names``. This module only uses
+the standard library so that importing it stays cheap for the serving and
+scoring entry points.
+"""
+import os
+
+SEED = 7
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(HERE, '..', 'data', 'cmc.data')
+MODEL_PATH = os.path.join(HERE, 'finalized_model_rfcl.sav')
+
+headers = ['wife_age', 'wife_education', 'husband_education', 'number_children_ever_born',
+           'wife_religion', 'wife_working', 'husband_occupation', 'standard_living',
+           'media_exposure', 'contraceptive_method_used']
+TARGET = 'contraceptive_method_used'
+
+# The final RandomForestClassifier is fitted on the first seven predictors (X_balanced)
+FEATURES = headers[:7]
+
+# Inclusive (low, high) bounds per attribute, None means unbounded
+DOMAINS = {
+    'wife_age': (0, None),                   # numerical
+    'wife_education': (1, 4),                # categorical 1=low, 2, 3, 4=high
+    'husband_education': (1, 4),             # categorical 1=low, 2, 3, 4=high
+    'number_children_ever_born': (0, None),  # numerical
+    'wife_religion': (0, 1),                 # binary 0=Non-Islam, 1=Islam
+    'wife_working': (0, 1),                  # binary 0=Yes, 1=No
+    'husband_occupation': (1, 4),            # categorical 1, 2, 3, 4
+    'standard_living': (1, 4),               # categorical 1=low, 2, 3, 4=high
+    'media_exposure': (0, 1),                # binary 0=Good, 1=Not good
+    'contraceptive_method_used': (1, 3),     # class attribute
+}
+
+CLASSES = {1: 'no-use', 2: 'long-term', 3: 'short-term'}
+
+
+def validate_record(record, features=FEATURES):
+    """ Return the values of ``features`` from a mapping as a list of ints.
+
+    Raises ValueError naming the first missing, non-integer or out-of-domain field.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('record must be a JSON object')
+    row = []
+    for name in features:
+        if name not in record:
+            raise ValueError(f'missing field {name}')
+        value = record[name]
+        if (isinstance(value, bool) or not isinstance(value, (int, float))
+                or (isinstance(value, float) and not value.is_integer())):
+            raise ValueError(f'{name} must be an integer, got {value!r}')
+        value = int(value)
+        low, high = DOMAINS[name]
+        if value < low or (high is not None and value > high):
+            bounds = f'[{low}, {high}]' if high is not None else f'>= {low}'
+            raise ValueError(f'{name}={value} is outside its domain {bounds}')
+        row.append(value)
+    return row
+
+
+def load_dataset(path=DATA_PATH):
+    """ Read ``cmc.data`` into a DataFrame with the ``headers`` columns """
+    import pandas as pd
+    return pd.read_csv(path, names=headers)
+
+
+def balanced_indices(y, seed=SEED):
+    """ Positions of ``y`` with classes 2 and 3 drawn with replacement up to the size of class 1.
+
+    The same draws as ``DataFrame.sample(..., replace=True, random_state=seed)``.
+    """
+    import numpy as np
+    y = np.asarray(y)
+    class_1 = np.flatnonzero(y == 1)
+    samples = [class_1]
+    for label in (2, 3):
+        rows = np.flatnonzero(y == label)
+        samples.append(rows[np.random.RandomState(seed).choice(len(rows), len(class_1), replace=True)])
+    return np.concatenate(samples)
+
+
+def balanced_splits(splits, y, seed=SEED):
+    """ (train, test) index splits with only the training side oversampled by ``balanced_indices``.
+
+    Oversampling before splitting would put copies of a row on both sides.
+    """
+    for train, test in splits:
+        yield train[balanced_indices(y[train], seed)], test
+
+
+def balance_classes(df, seed=SEED):
+    """ Oversample every class to the size of class 1 (no-use), as done before the final fit """
+    return df.iloc[balanced_indices(df[TARGET].values, seed)]
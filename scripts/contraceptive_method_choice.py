@@ -1,916 +1,440 @@
 # -*- coding: utf-8 -*-
-"""contraceptive_method_choice.ipynb
+"""contraceptive_method_choice
 
-Automatically generated by Colaboratory.
+Training pipeline for the contraceptive method choice model, organised as a DAG
+of named stages (see ``pipeline.py``):
 
-Original file is located at
-    https://colab.research.google.com/drive/14Wab6GFhA08hhVtMUbpyjZAWahDGHB8C
+    load -> eda
+    load -> split -> tune ------.
+    load -> select -> compare -> evaluate
+            select -> encoded
+    load -> balance -> final_fit -> export
+
+Every stage output is memoized under ``.pipeline_cache`` and keyed by the
+stage's code, configuration and inputs, so a rerun only executes what changed.
+The exploratory analysis (PCA, MLP, fold-count curves) and its commentary live
+in ``notebooks/contraceptive_method_choice.ipynb``.
 
 # Dataset Description
 <p>This dataset is a subset of the 1987 National Indonesia Contraceptive Prevalence Survey. The samples are married women who were either not pregnant or do not know if they were at the time of interview. The problem is to predict the current contraceptive method choice<strong>(no use, long-term methods, or short-term methods)</strong> of a woman based on her demographic and socio-economic characteristics.
 <a href="https://archive.ics.uci.edu/ml/datasets/Contraceptive+Method+Choice" target="_blank" >cmc</a></p>
 
-#### Inclusion of needed packages and libraries
-"""
-
-# Commented out IPython magic to ensure Python compatibility.
-# %matplotlib inline
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression
-from pandas.plotting import scatter_matrix
-from scipy.stats import pearsonr
-from scipy.stats import shapiro, normaltest, chi2_contingency
-ALPHA = 0.05
-
-sns.set()
-sns.set_theme()
-plt.style.use('classic')
-plt.rcParams.update({ "font.family": "serif",})
-
-"""#### <b> Note that LR is for LogisticRegression </b>
-
-### Dataset Uploading
-"""
-
-headers = ['wife_age', 'wife_education', 'husband_education', 'number_children_ever_born',
-           'wife_religion', 'wife_working', 'husband_occupation', 'standard_living',
-           'media_exposure', 'contraceptive_method_used']
-filename = "../data/cmc.data"
-df = pd.read_csv(filename, names=headers)
-
-"""### Data Preprocessing"""
-
-headers[:7]
-
-print(f'Dataset info : \n {df.info()} \n Dataset Variables data types : \n {df.dtypes}')
-
-print(f'Contains no values : \n {df.isnull().sum()} \n Contains NaN : \n {df.isna().sum()}')
-
-df.shape
-
-df.head(7)
-
-df['contraceptive_method_used'].value_counts()
-sns.histplot(df['contraceptive_method_used'])
-plt.show()
-
-"""The dataset contains 10 variables with 1473 observations in which there 9 predictors and 1 target (contraceptive_method_choice). All observations are integers and the dataset contains no missing values. The target has two types of value 1 (no-use), 2 (short-term) and 3 (long-term).This is a prediction by classifying if the woman's contraceptive method choice doesn't exist(no-use) ,is short-term method usage and long-term method. The observations per class are 629 for no-use, 511 for short-term method and 333 for long-term method.<b> So, the contraceptive_method_choice class is unbalanced.</b>
-
----
-
-#### Descriptive Statistics
+Usage
+    python contraceptive_method_choice.py                 # run what changed
+    python contraceptive_method_choice.py --list          # show stages and cache state
+    python contraceptive_method_choice.py compare         # only compare and its inputs
+    python contraceptive_method_choice.py --force tune    # rerun tune and everything after it
 """
+import argparse
+import importlib
+import os
 
-df.describe()
-
-"""The wife age ranges between 16 and 49. The average is around 32 years old. The standard deviation is around 8, so the observations of the wife_age variable are not too scattered. <b>We'll need to standardize predictors(to put them in a same range of values)</b>"""
-
-correlations = df.corr(method='pearson')
-correlations.style.background_gradient()
-
-""" Correlation matrix plot """
-plt.style.use('classic')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 5))
-ax = plt.axes()
-cax = ax.matshow(correlations, vmin=-1, vmax=1)
-cbar = fig.colorbar(cax)
-ticks = np.arange(0,10,1)
-ax.set_xticks(ticks)
-ax.set_yticks(ticks)
-ax.set_yticklabels(headers)
-plt.show()
-
-pearsonr(df['wife_education'], df['husband_education'])
-
-plt.figure(figsize=(10, 4))
-plt.rcParams.update({ "font.family": "serif", "font.size": 13})
-sns.scatterplot(
-    data=df, x="wife_education", y="husband_education", hue="contraceptive_method_used",
-    palette = 'deep'
-)
-plt.legend()
-plt.show()
-
-stat, p = pearsonr(df['wife_education'], df['husband_education'])
-print('stat=%.3f, p=%.3f' % (stat, p))
-if p > 0.05:
-	print('Probably independent')
-else:
-	print('Probably dependent')
-
-"""This shows that the wife_education and the husband_eduction variables are moderately correlated. Others predictors than wife_education and husband_education are not correlated.<b>The correlation is given with a p-value under 0.001 though the scatter plot doesn't show that. The pearson test confirms that wife_education and husband_education are dependant</b> We can assume these other predictors are independant with the target."""
-
-df.hist(bins=20, layout=(5, 5), sharex=False, figsize=(17, 15))
-plt.show()
-
-df.plot(kind='density', subplots=True, layout=(5, 5), sharex=False, figsize=(17, 15))
-plt.show()
-
-"""This above plots show that  the predictors number children_ever_born and wife_age except the others seem to have a certain normal distribution."""
-
-df.plot(kind = 'box', subplots=True, layout=(5, 5), sharex=False, figsize=(17, 15))
-plt.show()
-
-"""The observations of wife_age predictors are well distributed, which is not the same case for others predictors.
-
-#### Hypotheses Tests (Gaussianity)
-
-H0: the sample has a Gaussian distribution.
-    H1: the sample does not have a Gaussian distribution.
-
-##### The Shapiro Test
-"""
-
-for predictor_name in headers:
-  stat, p = shapiro(df[predictor_name])
-  if p > ALPHA:
-    print(f'{predictor_name} probably Gaussian')
-  else:
-    print(f'{predictor_name} probably not Gaussian')
-
-"""##### The Normaltest Test"""
-
-for predictor_name in headers:
-  stat, p = normaltest(df[predictor_name])
-  if p > ALPHA:
-    print(f'{predictor_name} probably Gaussian')
-  else:
-    print(f'{predictor_name} probably not Gaussian')
-
-"""<b>After these two hypotheses tests, we can confirm that no predictor is gaussian, has a normal distribution for a confidence interval of 95%.</b>
-
-#### Hypotheses Tests (Independance)
-
-H0: the two samples are independent.
-    H1: there is a dependency between the samples.
-
-##### The Chi-Squared Test
-"""
-
-for predictor_name in headers:
-    table = pd.crosstab( df['contraceptive_method_used'], df[predictor_name] )
-    stat, p, dof, expected = chi2_contingency(table)
-    if p > ALPHA:
-      pass
-      print(f'contraceptive_method_used & {predictor_name} are probably independent')
-    else:
-      print(f'contraceptive_method_used & {predictor_name} are probably dependent')
-
-for predictor_name1 in headers:
-  for predictor_name2 in headers:
-    table = pd.crosstab( df[predictor_name1], df[predictor_name2] )
-    stat, p, dof, expected = chi2_contingency(table)
-    # print('stat=%.3f, p=%.3f' % (stat, p))
-    print(f'stat={np.round(stat, 3)}, p={np.round(p, 4)}')
-    if p > ALPHA:
-      pass
-      print(f'{predictor_name1} & {predictor_name2} are probably independent')
-    else:
-      print(f'{predictor_name1} & {predictor_name2} are probably dependent')
-
-"""##### All predictors except wife_working and the target (contraceptive_method_used) are dependant. Then, we can assume that most accurate variables for predicting contraceptive_method_used target are all the predictors except <b>wife_working</b> with a confidence interval of 95%.
-
-#### Data Standardization
-"""
-
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import(
-    train_test_split, KFold, cross_val_score, RepeatedStratifiedKFold, GridSearchCV
-)
-
-from sklearn.linear_model import  LogisticRegression
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.svm import  SVC
-
-from sklearn.metrics import (
-    classification_report, confusion_matrix, accuracy_score, mean_absolute_error
-)
-
-X = df.drop('contraceptive_method_used', axis=1)
-y = df["contraceptive_method_used"]
-seed = 7
-
-scaler = StandardScaler()
-scaled_X = scaler.fit_transform(X)
-
-"""##### Data Splitting"""
-
-X_train, X_test, y_train, y_test = train_test_split(scaled_X, y, test_size=0.3, random_state=seed)
-
-"""Algorithms to test """
-
-models = []
-models.append(('LR', LogisticRegression()))
-models.append(('LDA', LinearDiscriminantAnalysis()))
-models.append(('KNN', KNeighborsClassifier()))
-models.append(('CART', DecisionTreeClassifier()))
-models.append(('NB', GaussianNB()))
-models.append(('SVM', SVC()))
-
-"""Printing training accuracy"""
-
-results = []
-names = []
-for name, model in models:
-  kfold = KFold(n_splits=10, random_state=seed, shuffle=True)
-  cv_results = cross_val_score(model, X_train, y_train, cv=kfold, scoring='accuracy')
-  results.append(cv_results)
-  names.append(name)
-  print(f"{name} accuracy ({cv_results.mean()}) std ({cv_results.std()})")
-
-""" Plotting Comparison """   
-plt.style.use('classic')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-ax.set_xticklabels(names)
-plt.ylabel('Training Accuracy')
-plt.show()
-
-"""##### <b>The SVM (SVC) classifier has the largest training accuracy, but it's not good enough. Can we do better ?</b>
-
-#### Parameters Tuning
-
-###### Tuning LogisticRegression parameters (Regularization, max_iter)
-
-###### <b> For penalty = l1 </b>
-"""
-
-max_iters = [1_000, 10_000, 100_000, 10000000]
-
-for iter in max_iters:
-
-  clf_l1_LR = LogisticRegression(penalty='l1', tol=0.01, solver='saga', max_iter=iter, multi_class='multinomial')
-  kfold = KFold(n_splits=10, random_state=seed, shuffle=True)
-  cv_results = cross_val_score(clf_l1_LR, X_train, y_train, cv=kfold, scoring='accuracy')
-  print(f'Accuracy ({cv_results.mean()}), std ({cv_results.std()})')
-
-"""###### <b> For penalty = l2 </b>"""
-
-max_iters = [1_000, 10_000, 100_000, 10000000]
-
-for iter in max_iters:
-
-  clf_l2_LR = LogisticRegression(penalty='l2', tol=0.01, solver='newton-cg', max_iter=iter, multi_class='multinomial')
-  kfold = KFold(n_splits=10, random_state=seed, shuffle=True)
-  cv_results = cross_val_score(clf_l2_LR, X_train, y_train, cv=kfold, scoring='accuracy')
-  print(f'Accuracy ({cv_results.mean()}), std ({cv_results.std()})')
-
-"""###### <b> For penalty = elasticnet </b>"""
-
-max_iters = [1_000, 10_000, 100_000, 10000000]
-l1_ratio = 0.5
-
-for iter in max_iters:
-  clf_en_LR = LogisticRegression(penalty='elasticnet', solver='saga',l1_ratio=0.5, tol=0.01, max_iter=iter, multi_class='multinomial')
-
-  kfold = KFold(n_splits=10, random_state=seed, shuffle=True)
-  cv_results = cross_val_score(clf_en_LR, X_train, y_train, cv=kfold, scoring='accuracy')
-  print(f'Accuracy ({cv_results.mean()}), std ({cv_results.std()})')
-
-"""##### No improvement, the training and test accuracy remain the same as in the default configuration.
-
-##### ''' Prediction Accuracy, confusion_matrix in default configuration '''
-"""
-
-""" Prediction Accuracy, confusion_matrix in default configuration """
-model = LogisticRegression()
-fitted = model.fit(X_train, y_train)
-y_hat = fitted.predict(X_test)
-
-print(f"LogisticRegression\n Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-""" Prediction Accuracy, confusion_matrix in tuned configuration """
-
-max_iters = [1_000, 10_000, 100_000, 10000000]
-
-for iter in max_iters:
-  model = LogisticRegression(penalty='l2', tol=0.01, solver='newton-cg', max_iter=iter, multi_class='multinomial')
-  fitted = model.fit(X_train, y_train)
-  y_hat = fitted.predict(X_test)
-  print(f"Max_iterations : {iter}")
-  print(f"{accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-"""##### No improvement, the training and test accuracy remain the same as in the default configuration.
-
-###### <b>Tuning LDA parameters</b>
-"""
-
-model = LinearDiscriminantAnalysis()
-cv = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=1)
-grid = {'solver': ['svd', 'lsqr', 'eigen']}
-search = GridSearchCV(model, grid, scoring='accuracy', cv=cv, n_jobs=-1)
-results = search.fit(X_train, y_train)
-print('Training Accuracy: %.3f' % results.best_score_)
-print('Config: %s' % results.best_params_)
-
-"""##### No improvement, the training and test accuracy remain the same as in the default configuration"""
-
-model = LinearDiscriminantAnalysis(solver='lsqr')
-fit = model.fit(X_train, y_train)
-y_hat = fit.predict(X_test)
-
-print(f"LDA Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-"""###### <b>The best LDA configuration is obtained with lsqr solver. The LDA does better than the LogisticRegression in both training and test accuracy</b>
+from cmc_data import (DATA_PATH, FEATURES, HERE, MODEL_PATH, SEED, TARGET, balance_classes, balanced_indices,
+                      balanced_splits, load_dataset)
+from pipeline import Pipeline
 
-###### <b>Tuning KNN parameters</b>
-"""
-
-cv = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=1)
-grid_params = {
-    'n_neighbors': list(range(1, 10)),
-    'weights' : ['uniform', 'distance'],
-    'algorithm': ['ball_tree', 'kd_tree', 'brute', 'auto'],
-    'metric' : ['euclidean', 'manhattan', 'minkowski'],
+ALPHA = 0.05
+CACHE_DIR = os.path.join(HERE, '.pipeline_cache')
+REPORT_DIR = os.path.join(HERE, 'reports')
+
+TUNING_GRIDS = {
+    'LDA': {'solver': ['svd', 'lsqr', 'eigen']},
+    'KNN': {
+        'n_neighbors': list(range(1, 10)),
+        'weights': ['uniform', 'distance'],
+        'algorithm': ['ball_tree', 'kd_tree', 'brute', 'auto'],
+        'metric': ['euclidean', 'manhattan', 'minkowski'],
+    },
+    'CART': {
+        'criterion': ['entropy', 'gini'],
+        'splitter': ['best', 'random'],
+    },
+    'SVM': {
+        'C': [0.1, 1, 10, 100, 1000, 10000, 100000],
+        'gamma': [1, 0.1, 0.01, 0.001, 0.0001],
+        'decision_function_shape': ['ovo', 'ovr'],
+        'kernel': ['linear', 'poly', 'rbf'],
+    },
 }
 
-search = GridSearchCV(KNeighborsClassifier(n_jobs=-1), grid_params, scoring='accuracy', cv=cv, n_jobs=-1)
-results = search.fit(X_train, y_train)
-print('Mean Accuracy: %.3f' % results.best_score_)
-print('Config: %s' % results.best_params_)
-
-"""###### This is better than the default configuration of KNeighborsClassifier. The best configuration is <b>Config: {'algorithm': 'ball_tree', 'metric': 'manhattan', 'n_neighbors': 9, 'weights': 'uniform'}</b>
----
-
-
-"""
-
-model = KNeighborsClassifier(n_neighbors=9, weights='uniform',algorithm='ball_tree', metric='manhattan')
-fit = model.fit(X_train, y_train)
-y_hat = fit.predict(X_test)
-print(f"KNN Prediction Accuracy {accuracy_score(y_test, y_hat)} \n Confusion Matrix \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-"""##### Tuning CART DecisionTreeClassifier"""
 
-cv = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=1)
-grid_params = {
-    'criterion': ['entropy', 'gini'],
-    'splitter' : ['best', 'random'],
+# Estimators are imported on first use, only the modules of the models a stage runs get loaded
+ESTIMATORS = {
+    'LR': ('sklearn.linear_model', 'LogisticRegression', {'max_iter': 1000}),
+    'LDA': ('sklearn.discriminant_analysis', 'LinearDiscriminantAnalysis', {}),
+    'KNN': ('sklearn.neighbors', 'KNeighborsClassifier', {'n_jobs': -1}),
+    'CART': ('sklearn.tree', 'DecisionTreeClassifier', {'random_state': SEED}),
+    'SVM': ('sklearn.svm', 'SVC', {'shrinking': True, 'random_state': SEED}),
+    'LSVC': ('sklearn.svm', 'LinearSVC', {'max_iter': 10000, 'random_state': SEED}),
+    'BCL': ('sklearn.ensemble', 'BaggingClassifier', {'random_state': SEED}),
+    'RFCL': ('sklearn.ensemble', 'RandomForestClassifier', {'random_state': SEED}),
+    'ETCL': ('sklearn.ensemble', 'ExtraTreesClassifier', {'random_state': SEED}),
 }
 
-search = GridSearchCV(DecisionTreeClassifier(), grid_params, scoring='accuracy', cv=cv, n_jobs=-1)
-results = search.fit(X_train, y_train)
-print('Mean Accuracy: %.3f' % results.best_score_)
-print('Config: %s' % results.best_params_)
-
-"""<b>The DecisionTreeClassifier does not do better than the default configuration</b>
-
-###### Tuning  SVM (*SVC*) parameters
-"""
-
-cv = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=seed)
-param_grid = {'C': [0.1, 1, 10, 100, 1000, 10000, 100000],
-              'gamma': [1, 0.1, 0.01, 0.001, 0.0001],
-              'decision_function_shape': ['ovo', 'ovr'],
-              'kernel': ['linear', 'poly', 'rbf'] }
-  
-grid = GridSearchCV(SVC(shrinking=True), param_grid, scoring='accuracy', n_jobs=-1, refit=True,cv=cv, verbose=3) 
-results = grid.fit(X_train, y_train) 
-
-print('Mean Accuracy: %.3f' % results.best_score_)
-print('Config: %s' % results.best_params_)
-
-"""This is better than the default configuration of SVM SVC classifier. The <b>training accuracy is 0.554 when the training accuracy of the default configuration is 0.5372.</b>
-
-###### SVM (SVC) Prediction Accuracy
-"""
-
-model = SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)
-fitted  = model.fit(X_train, y_train)
-
-y_hat = fitted.predict(X_test)
-print(f"SVM(SVC) Prediction Accuracy {accuracy_score(y_test, y_hat)} \n Confusion Matrix \n{confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-"""###### Prediction Accuray of all algorithms"""
-
-models = []
-models.append(('LR', LogisticRegression()))
-models.append(('LDA',  LinearDiscriminantAnalysis(solver='lsqr')))
-models.append(('KNN', KNeighborsClassifier(n_neighbors=9,weights='uniform', algorithm='ball_tree', metric='manhattan')))
-models.append(('CART', DecisionTreeClassifier()))
-models.append(('NB', GaussianNB()))
-models.append(('SVM', SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)))
-
-results = []
-names = []
-for name, model in models:
-   kfold = KFold(n_splits=3)
-   cv_results = cross_val_score(model, X_train, y_train, cv=kfold, scoring='accuracy')
-   results.append(cv_results)
-   names.append(name)
-
-   fitted  = model.fit(X_train, y_train)
-   y_hat = fitted.predict(X_test)
-   print(f"{name} Training TAccuracy ({name, cv_results.mean()}) STD ({cv_results.std()})")
-   print(f"{name} Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-""" Plotting Comparison """   
-plt.style.use('classic')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-plt.ylabel('Training Accuracy')
-
-ax.set_xticklabels(names)
-plt.show()
-
-"""##### The SVM (SVC) does <b>much better than all other tested algorithms with a training accuracy of 0.545 and 0.5497 as testing accuracy</b>". Can we do better again ?"""
-
-from sklearn.neural_network import  MLPClassifier
-
-fitted = model.fit(X_train, y_train)
-
-cv = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=seed)
-kfold = KFold(n_splits=3)
-cv_results = cross_val_score(model, X_train, y_train, cv=cv, scoring='accuracy')
-print(cv_results.mean(), cv_results.std())
-
-model = MLPClassifier(random_state=seed, hidden_layer_sizes=100, activation='tanh',
-                      solver='lbfgs', alpha=0.0001,max_iter = 10000,
-                      )
-fitted = model.fit(X_train, y_train)
-
-cv = RepeatedStratifiedKFold(n_splits=10, n_repeats=3, random_state=seed)
-# kfold = KFold(n_splits=3)
-cv_results = cross_val_score(model, X_train, y_train, cv=cv, scoring='accuracy')
-print(cv_results.mean(), cv_results.std())
-
-"""##### The neuronal network MLPClassifier is worse for both training and prediction accuracy"""
-
-from sklearn.ensemble import(
-    BaggingClassifier, RandomForestClassifier,ExtraTreesClassifier
-)
-
-ensembles = []
-ensembles.append(('BCL', BaggingClassifier()))
-ensembles.append(('RFCL', RandomForestClassifier()))
-ensembles.append(('ETCL', ExtraTreesClassifier()))
-
-results = []
-names = []
-for name, ensemble in ensembles:
-    kfold = KFold(n_splits=3)
-    
-    cv_results = cross_val_score(ensemble, X_train, y_train, cv=kfold, scoring="accuracy")
-    results.append(cv_results)
-    names.append(name)
-    print(f"{name} Training accuracy ({cv_results.mean()}) SDT ({cv_results.std()})")
-
-""" Plotting Comparison """   
-plt.style.use('seaborn-deep')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-ax.set_xticklabels(names)
-plt.show()
-
-"""###### <b> The RandomForestClassifier performs better as the SVM (SVC) classifier<b>.
-
-### <b>Feature Selection</b>
-"""
-
-X = df.drop('contraceptive_method_used', axis=1)
-y = df["contraceptive_method_used"]
-from sklearn.feature_selection import SelectKBest, chi2
-
-"""###### Predictors Selection with <b>chi2</b>"""
-
-best = SelectKBest(score_func=chi2, k=3)
-X_NEW = best.fit_transform(X, y)
-
-X_NEW_train, X_NEW_test, y_new_train, y_new_test = train_test_split(X_NEW, y, test_size=0.3,random_state=seed)
-
-""" Adding Algorithms """
-models = []
-models.append(('LR', LogisticRegression(max_iter=1000)))
-models.append(('LDA',  LinearDiscriminantAnalysis(solver='lsqr')))
-models.append(('KNN', KNeighborsClassifier(n_neighbors=9,weights='uniform', algorithm='ball_tree', metric='manhattan')))
-models.append(('SVM', SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)))
-models.append(('RFCL', RandomForestClassifier(criterion='entropy')))
-
-""" Cross_validation """
-results = []
-names = []
-for name, model in models:
-   kfold = KFold(n_splits=3)
-
-   cv_results = cross_val_score(model, X_NEW_train, y_new_train, cv=kfold, scoring='accuracy')
-   results.append(cv_results)
-   names.append(name)
-
-   fitted  = model.fit(X_NEW_train, y_new_train)
-   y_hat = fitted.predict(X_NEW_test)
-   print(f"{name} Training TAccuracy ({name, cv_results.mean()}) STD ({cv_results.std()})")
-   print(f"{name} Prediction Accuracy {accuracy_score(y_new_test, y_hat)} \n {confusion_matrix(y_new_test, y_hat)} \n {classification_report(y_new_test, y_hat)} ")
-
-""" Cross_validation """
-results = []
-names = []
-for name, model in models:
-   kfold = KFold(n_splits=3)
-
-   cv_results = cross_val_score(model, X_NEW_train, y_new_train, cv=kfold, scoring='accuracy')
-   results.append(cv_results)
-   names.append(name)
-
-   fitted  = model.fit(X_NEW_train, y_new_train)
-   y_hat = fitted.predict(X_NEW_test)
-   print(f"{name} Training TAccuracy ({name, cv_results.mean()}) STD ({cv_results.std()})")
-   print(f"{name} Prediction Accuracy {accuracy_score(y_new_test, y_hat)} \n {confusion_matrix(y_new_test, y_hat)} \n {classification_report(y_new_test, y_hat)} ")
-
-""" Plot Algorithms Comparison """
-""" Plotting Comparison """   
-plt.style.use('classic')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-ax.set_xticklabels(names)
-plt.show()
-
-"""<b>The SVM (SVC) remains much better than other algorithms for k predictors, k = 3.</b>
-
-<b> Seek the best k fold </b>
-"""
-
-list_training_error = []
-list_testing_error = []
-data = df.values
-X = data[:, :9]
-y = data[:, 9]
-
-kf = KFold(n_splits=20)
-
-for train_index, test_index in kf.split(X):
-  X_train, X_test = X[train_index], X[test_index]
-  y_train, y_test = y[train_index], y[test_index]
-  model = SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)
-  
-  model.fit(X_train, y_train)
-  y_train_data_pred = model.predict(X_train)
-  y_test_data_pred = model.predict(X_test)
-
-  fold_training_error = mean_absolute_error(y_train, y_train_data_pred) 
-  fold_testing_error = mean_absolute_error(y_test, y_test_data_pred)
-
-  list_training_error.append(fold_training_error)
-  list_testing_error.append(fold_testing_error)
-
-plt.figure(figsize=(12, 5))
-plt.subplot(1,2,1)
-plt.plot(range(1, kf.get_n_splits() + 1), np.array(list_training_error).ravel(), 'o-')
-plt.xlabel('number of fold')
-plt.ylabel('training error')
-plt.title('Training error across folds')
-plt.tight_layout()
-plt.subplot(1,2,2)
-plt.plot(range(1, kf.get_n_splits() + 1), np.array(list_testing_error).ravel(), 'o-')
-plt.xlabel('number of fold')
-plt.ylabel('testing error')
-plt.title('Testing error across folds')
-plt.tight_layout()
-plt.show()
-
-"""##### <b>It's k = 3 as used in the cross_validation of SVC Classifier.</b> Can we improve with PCA"""
-
-from sklearn.decomposition import PCA
-
-pca = PCA()
-pca.fit(scaled_X)
-
-exp_variance = pca.explained_variance_ratio_
-fig, ax = plt.subplots()
-ax.bar(range(pca.n_components_), exp_variance)
-ax.set_xlabel('Principal Component #')
-
-"""It's not clear to see where the elbow appears, but take 6 components of 85%."""
-
-cum_exp_variance = np.cumsum(exp_variance)
-
-fig, ax = plt.subplots()
-ax.plot(cum_exp_variance)
-ax.axhline(y=0.85, linestyle='--')
-
-n_components = 6
-
-pca = PCA(n_components, random_state=seed)
-pca.fit(scaled_X)
-pca_projection = pca.transform(scaled_X)
-
-X_train_pca, X_test_pca, y_train_pca, y_test_pca = train_test_split(
-    pca_projection, df['contraceptive_method_used'], random_state=seed,
-)
-
-model = SVC()
-fitted  = model.fit(X_train_pca, y_train_pca)
-
-cross_val_results = cross_val_score(model, X_train_pca, y_train_pca, scoring='accuracy', cv=KFold(n_splits=3))
-print(cross_val_results.mean(), cross_val_results.std())
-
-y_hat_pca = fitted.predict(X_test_pca)
-print(f"PCA SVM(SVC) Prediction Accuracy {accuracy_score(y_test_pca, y_hat_pca)} \n Confusion Matrix \n{confusion_matrix(y_test_pca, y_hat_pca)} \n {classification_report(y_test_pca, y_hat_pca)} ")
-
-"""<b>This is not better than the chi2 feature selection.</b> Let's balance the classes ?
-
-###### <>With stratify arg<>
-"""
-
-X = df.drop('contraceptive_method_used', axis=1)
-scaled_X = scaler.fit_transform(X)
-y = df["contraceptive_method_used"]
-X_bal_train, X_bal_test, y_bal_train, y_bal_test = train_test_split(scaled_X, y, test_size=0.2, random_state=seed,stratify=y)
-
-model = SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)
-fitted  = model.fit(X_bal_train, y_bal_train)
-cross_val_results = cross_val_score(model, X_bal_train, y_bal_train, scoring='accuracy', cv=KFold(n_splits=10))
-print(f"SVM(SVC) \nTraining Accuracy ({cross_val_results.mean()}), STD ({cross_val_results.std()})")
-
-y_hat_pca = fitted.predict(X_bal_test)
-print(f"Prediction Accuracy {accuracy_score(y_bal_test, y_hat_pca)} \n Confusion Matrix \n{confusion_matrix(y_bal_test, y_hat_pca)} \n {classification_report(y_bal_test, y_hat_pca)} ")
-
-"""###### <b> Balancing the data by sampling </b>"""
 
-df_class_1 = df[df['contraceptive_method_used'] == 1]
-df_class_2 = df[df['contraceptive_method_used'] == 2]
-df_class_3 = df[df['contraceptive_method_used'] == 3]
+def base_estimator(name, estimators=ESTIMATORS):
+    """ Untuned estimator for a model name of the comparison """
+    module, class_name, params = estimators[name]
+    return getattr(importlib.import_module(module), class_name)(**params)
 
-df_class_2 = df_class_2.sample(df_class_1.shape[0], replace=True, random_state=seed)
-df_class_3 = df_class_3.sample(df_class_1.shape[0], replace=True, random_state=seed)
 
-data = pd.concat([df_class_1, df_class_2, df_class_3])
-print(data['contraceptive_method_used'].value_counts())
-
-"""<b>The classes are now well balanced</b>"""
-
-X_train, X_test, y_train, y_test = train_test_split(
-    scaler.fit_transform(data.drop('contraceptive_method_used', axis=1)), data['contraceptive_method_used'],
-    test_size=0.3, random_state=seed, stratify=data['contraceptive_method_used']
-)
-
-model = SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)
-
-fitted  = model.fit(X_train, y_train)
-cross_val_results = cross_val_score(model, X_train, y_train, scoring='accuracy', cv=KFold(n_splits=10))
-print(f"SVM(SVC) \nTraining Accuracy ({cross_val_results.mean()}), STD ({cross_val_results.std()})")
-
-y_hat = fitted.predict(X_test)
-print(f"Prediction Accuracy {accuracy_score(y_test, y_hat)} \n Confusion Matrix \n{confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-"""<b>The SVM (SVC) does more much better than the unbalanced case.</b> Can we have better ?
-
-<b>Chi2 Feature Selection after balancing classes</b>
-"""
+def prediction_report(name, y_test, y_hat):
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+    print(f"{name} Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
 
-best = SelectKBest(score_func=chi2, k=7)
-y = data['contraceptive_method_used']
-X = data.drop('contraceptive_method_used', axis=1)
-X_NEW = best.fit_transform(X, y)
 
-X_NEW_train, X_NEW_test, y_new_train, y_new_test = train_test_split(
-    X_NEW, y, test_size=0.3, random_state=seed, stratify=data['contraceptive_method_used'],
+def plot_style():
+    """ Plot theme of the notebook, applied by the stages that draw """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_theme()
+    plt.style.use('classic')
+    plt.rcParams.update({"font.family": "serif"})
+
+
+def save_figure(fig, report_dir, filename):
+    os.makedirs(report_dir, exist_ok=True)
+    fig.savefig(os.path.join(report_dir, filename), bbox_inches='tight')
+
+
+def comparison_figure(results, names, report_dir, filename, ylabel='Training Accuracy'):
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(10, 4))
+    fig.suptitle('Algorithm Comparison')
+    ax = fig.add_subplot(111)
+    ax.boxplot(results)
+    ax.set_xticklabels(names)
+    ax.set_ylabel(ylabel)
+    save_figure(fig, report_dir, filename)
+
+
+def module_path(name):
+    return os.path.join(HERE, f'{name}.py')
+
+
+# Modules of the helpers the stages call, declared as stage files so that editing them invalidates the cache
+DATA_MODULES = [module_path('cmc_data')]
+CV_MODULES = [module_path('fold_cache'), module_path('parallel')]
+# Helpers of this script the stages call, their source is hashed into the stage keys
+REPORT_HELPERS = [prediction_report, plot_style, save_figure, comparison_figure]
+
+pipeline = Pipeline(CACHE_DIR)
+
+
+@pipeline.stage(files=[DATA_PATH] + DATA_MODULES)
+def load(filename=DATA_PATH):
+    """ Dataset Uploading. 1473 observations of 9 predictors and the target, no missing values """
+    return load_dataset(filename)
+
+
+@pipeline.stage(helpers=[plot_style, save_figure])
+def eda(load, report_dir=REPORT_DIR, alpha=ALPHA):
+    """ Descriptive statistics, correlations and hypotheses tests, figures go to ``report_dir`` """
+    import numpy as np
+    import pandas as pd
+    import seaborn as sns
+    from matplotlib.figure import Figure
+    from scipy.stats import chi2_contingency, normaltest, pearsonr, shapiro
+
+    df = load
+    headers = list(df.columns)
+    plot_style()
+    print(f"Class counts \n{df[TARGET].value_counts()}")
+
+    correlations = df.corr(method='pearson')
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot(111)
+    cax = ax.matshow(correlations, vmin=-1, vmax=1)
+    fig.colorbar(cax)
+    ticks = np.arange(0, 10, 1)
+    ax.set_xticks(ticks)
+    ax.set_yticks(ticks)
+    ax.set_yticklabels(headers)
+    save_figure(fig, report_dir, 'correlations.png')
+
+    stat, p = pearsonr(df['wife_education'], df['husband_education'])
+    print('wife_education & husband_education pearson stat=%.3f, p=%.3f' % (stat, p))
+    fig = Figure(figsize=(10, 4))
+    sns.scatterplot(
+        data=df, x="wife_education", y="husband_education", hue=TARGET,
+        palette='deep', ax=fig.add_subplot(111),
     )
-
-""" Adding Algorithms """
-models = []
-models.append(('LR', LogisticRegression(max_iter=1000)))
-models.append(('LDA',  LinearDiscriminantAnalysis(solver='lsqr')))
-models.append(('KNN', KNeighborsClassifier(n_neighbors=9,weights='uniform', algorithm='ball_tree', metric='manhattan')))
-models.append(('SVM', SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)))
-models.append(('RFCL', RandomForestClassifier()))
-
-""" Cross_validation """
-results = []
-names = []
-for name, model in models:
-   kfold = RepeatedStratifiedKFold(n_splits=13, n_repeats=3, random_state=seed)
-
-   cv_results = cross_val_score(model, X_NEW_train, y_new_train, cv=kfold, scoring='accuracy')
-   results.append(cv_results)
-   names.append(name)
-
-   fitted  = model.fit(X_NEW_train, y_new_train)
-   y_hat = fitted.predict(X_NEW_test)
-   print(f"{name} Training Accuracy ({name, cv_results.mean()}) STD ({cv_results.std()})")
-   print(f"{name} Prediction Accuracy {accuracy_score(y_new_test, y_hat)} \n {confusion_matrix(y_new_test, y_hat)} \n {classification_report(y_new_test, y_hat)} ")
-
-""" Plot Algorithms Comparison """
-""" Plotting Comparison """   
-plt.style.use('classic')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-ax.set_xticklabels(names)
-plt.show()
-
-"""###### <b> The RandomForestClassifier does much better than the SVC classifier as shown by the plot above</b>
-
-#### Let's check again PCA
-"""
-
-pca = PCA()
-pca.fit(scaler.fit_transform(data.drop('contraceptive_method_used', axis=1)))
-
-exp_variance = pca.explained_variance_ratio_
-fig, ax = plt.subplots()
-ax.bar(range(pca.n_components_), exp_variance)
-ax.set_xlabel('Principal Component #')
-
-cum_exp_variance = np.cumsum(exp_variance)
-
-fig, ax = plt.subplots()
-ax.plot(cum_exp_variance)
-ax.axhline(y=0.85, linestyle='--')
-n_components = 6
-pca = PCA(n_components, random_state=seed)
-pca.fit(scaled_X)
-pca_projection = pca.transform(scaled_X)
-
-X_train_pca, X_test_pca, y_train_pca, y_test_pca = train_test_split(
-    pca_projection, df['contraceptive_method_used'], random_state=seed,
-)
-
-model = SVC(C=100, kernel='rbf', gamma=0.01, shrinking=True, probability=True)
-fitted  = model.fit(X_train_pca, y_train_pca)
-
-cross_val_results = cross_val_score(model, X_train_pca, y_train_pca, scoring='accuracy', cv=KFold(n_splits=16))
-print(cross_val_results.mean(), cross_val_results.std())
-
-y_hat_pca = fitted.predict(X_test_pca)
-print(f"PCA SVM(SVC) Prediction Accuracy {accuracy_score(y_test_pca, y_hat_pca)} \n Confusion Matrix \n{confusion_matrix(y_test_pca, y_hat_pca)} \n {classification_report(y_test_pca, y_hat_pca)} ")
-
-"""<b>This is worse according to the previous algorithms. Then, by conclusion, the better model is obtained with k = 7 features(chi2 selection) with RandomForestClassifier.</b>"""
-
-list_training_error = []
-list_testing_error = []
-values = data.values
-X = values[:, :7]
-y = values[:, 9]
-
-kf = KFold(n_splits=20)
-
-for train_index, test_index in kf.split(X):
-  X_train, X_test = X[train_index], X[test_index]
-  y_train, y_test = y[train_index], y[test_index]
-  model = RandomForestClassifier()
-  
-  model.fit(X_train, y_train)
-  y_train_data_pred = model.predict(X_train)
-  y_test_data_pred = model.predict(X_test)
-
-  fold_training_error = mean_absolute_error(y_train, y_train_data_pred) 
-  fold_testing_error = mean_absolute_error(y_test, y_test_data_pred)
-
-  list_training_error.append(fold_training_error)
-  list_testing_error.append(fold_testing_error)
-
-plt.figure(figsize=(12, 5))
-plt.subplot(1,2,1)
-plt.plot(range(1, kf.get_n_splits() + 1), np.array(list_training_error).ravel(), 'o-')
-plt.xlabel('number of fold')
-plt.ylabel('training error')
-plt.title('Training error across folds')
-plt.tight_layout()
-plt.subplot(1,2,2)
-plt.plot(range(1, kf.get_n_splits() + 1), np.array(list_testing_error).ravel(), 'o-')
-plt.xlabel('number of fold')
-plt.ylabel('testing error')
-plt.title('Testing error across folds')
-plt.tight_layout()
-plt.show()
-
-"""<b>The best kfold value is between 15 and 17 for cross validation</b>"""
-
-best = SelectKBest(score_func=chi2, k=7)
-y = data['contraceptive_method_used']
-X = data.drop('contraceptive_method_used', axis=1)
-X_NEW = best.fit_transform(X, y)
-
-X_NEW_train, X_NEW_test, y_new_train, y_new_test = train_test_split(
-    X_NEW, y, test_size=0.3, random_state=seed,
+    save_figure(fig, report_dir, 'education_scatter.png')
+
+    for kind in ('hist', 'density', 'box'):
+        fig = Figure(figsize=(17, 15))
+        axes = fig.subplots(5, 5).ravel()
+        # One axes per column, the rest of the 5 x 5 grid stays empty
+        if kind == 'hist':
+            df.hist(bins=20, sharex=False, ax=axes[:len(headers)])
+        else:
+            df.plot(kind=kind, subplots=True, sharex=False, ax=axes[:len(headers)])
+        for ax in axes[len(headers):]:
+            ax.set_axis_off()
+        save_figure(fig, report_dir, f'{kind}.png')
+
+    # H0: the sample has a Gaussian distribution
+    gaussianity = pd.DataFrame({
+        'shapiro_p': [shapiro(df[name])[1] for name in headers],
+        'normaltest_p': [normaltest(df[name])[1] for name in headers],
+    }, index=headers)
+    gaussianity['gaussian'] = (gaussianity > alpha).all(axis=1)
+
+    # H0: the two samples are independent
+    pairwise_p = pd.DataFrame(
+        [[chi2_contingency(pd.crosstab(df[a], df[b]))[1] for b in headers] for a in headers],
+        index=headers, columns=headers,
     )
-
-model = RandomForestClassifier()
-""" Cross_validation """
-
-cv_results = cross_val_score(model, X_NEW_train, y_new_train, cv=KFold(n_splits=16), scoring='accuracy')
-fitted  = model.fit(X_NEW_train, y_new_train)
-y_hat = fitted.predict(X_NEW_test)
-
-print(f"RFCL Training Accuracy ({cv_results.mean()}) STD ({cv_results.std()})")
-print(f"RFCL Prediction Accuracy {accuracy_score(y_new_test, y_hat)} \n {confusion_matrix(y_new_test, y_hat)} \n {classification_report(y_new_test, y_hat)} ")
-
-"""<b>The RFCL wins and the needed predictors are the seven obtained with chi2 for feature selection for predicting with an accuracy of 0.714 and the confusion matrix is much better than the one of the SVM (SVC) and other algorithms</b>.
-
-#### Ensemble with balanced class ( Contraceptive_method_used ) and chi2 feature selection
-"""
-
-best = SelectKBest(score_func=chi2, k=7)
-y = data['contraceptive_method_used']
-X = data.drop('contraceptive_method_used', axis=1)
-X_NEW = best.fit_transform(X, y)
-
-X_train, X_test, y_train, y_test = train_test_split(X_NEW, y, test_size=0.3, random_state=seed)
-
-results = []
-names = []
-for name, ensemble in ensembles:
-    kfold = KFold(n_splits=16)
-    
-    cv_results = cross_val_score(ensemble, X_train, y_train, cv=kfold, scoring="accuracy")
-    results.append(cv_results)
-    names.append(name)
-
-    fitted  = ensemble.fit(X_train, y_train)
-    y_hat = fitted.predict(X_test)
-
-    print(f"{name} Error Test Rate {((y_hat != y_test).sum())/data.shape[0]*100}")
-    print(f"{name} Training accuracy ({cv_results.mean()}) SDT ({cv_results.std()})")
-    print(f"{name} Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-""" Plotting Comparison """   
-plt.style.use('seaborn-deep')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-ax.set_xticklabels(names)
-plt.show()
-
-"""#### <b>Conclusion : compare to other ensemble algorithms and SVM (SVC), RandomForestClassifier remains the best with 9% as test error rate, the best training and prediction accuracy and the confusion matrix.</b>
-
-#### <b> Test the first 7 predictors of the balanced dataframe </b>
-"""
-
-df_balanced = data.values
-X_balanced = df_balanced[:,:7]
-y_balanced = df_balanced[:,9]
-import pickle
-
-X_train, X_test, y_train, y_test = train_test_split(X_balanced, y_balanced, test_size=0.3, random_state=seed)
-
-model = RandomForestClassifier()
-""" Cross_validation """
-
-cv_results = cross_val_score(model, X_train, y_train, cv=KFold(n_splits=16), scoring='accuracy')
-model_rfcl = model.fit(X_train, y_train)
-y_hat = model_rfcl.predict(X_test)
-
-print(f"RFCL Training Accuracy ({cv_results.mean()}) STD ({cv_results.std()})")
-print(f"RFCL Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-results = []
-names = []
-for name, ensemble in ensembles:
-    kfold = KFold(n_splits=16)
-    
-    cv_results = cross_val_score(ensemble, X_train, y_train, cv=kfold, scoring="accuracy")
-    results.append(cv_results)
-    names.append(name)
-
-    fitted  = ensemble.fit(X_train, y_train)
-    y_hat = fitted.predict(X_test)
-
-    print(f"{name} Error Test Rate {((y_hat != y_test).sum())/data.shape[0]*100}")
-    print(f"{name} Training accuracy ({cv_results.mean()}) SDT ({cv_results.std()})")
-    print(f"{name} Prediction Accuracy {accuracy_score(y_test, y_hat)} \n {confusion_matrix(y_test, y_hat)} \n {classification_report(y_test, y_hat)} ")
-
-""" Plotting Comparison """   
-plt.style.use('seaborn-deep')
-plt.rcParams.update({ "font.family": "serif",})
-fig = plt.figure(figsize=(10, 4))
-fig.suptitle('Algorithm Comparison')
-ax = fig.add_subplot(111)
-plt.boxplot(results)
-ax.set_xticklabels(names)
-plt.show()
-
-"""###### <b>Finally : compare to other ensemble algorithms and SVM (SVC), RandomForestClassifier remains the best test error rate value between 8% and 9%, the best training and prediction accuracy and the confusion matrix with the first seven predictors of the balanced. These are the only variables that impact the woman's contraceptive method that she uses or will use</b>
-
-#### <b>Save the model for reuse purposes</b>
-"""
-
-model_filename = 'finalized_model_rfcl.sav'
-import joblib
-joblib.dump(model_rfcl, model_filename)
-
-
-
+    independent = pairwise_p[TARGET] > alpha
+    print(f"Gaussian predictors : {list(gaussianity.index[gaussianity['gaussian']])}")
+    print(f"Predictors probably independent of {TARGET} : {list(independent.index[independent])}")
+
+    return {
+        'describe': df.describe(),
+        'correlations': correlations,
+        'gaussianity': gaussianity,
+        'chi2_p_values': pairwise_p,
+    }
+
+
+@pipeline.stage()
+def split(load, test_size=0.3, seed=SEED):
+    """ Data Splitting for ``tune``.
+
+    The rows are returned unscaled, cross-validation scales inside each fold (see ``fold_cache.py``).
+    """
+    from sklearn.model_selection import train_test_split
+
+    X = load.drop(TARGET, axis=1).values
+    y = load[TARGET].values
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+    return {'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test}
+
+
+@pipeline.stage(files=CV_MODULES, helpers=[base_estimator])
+def tune(split, grids=TUNING_GRIDS, n_splits=10, n_repeats=3, seed=SEED, estimators=ESTIMATORS):
+    """ Parameters Tuning of LDA, KNN, CART and SVM (SVC) by grid search, scaled within each fold """
+    from sklearn.model_selection import RepeatedStratifiedKFold
+    from fold_cache import FoldCache, grid_search
+
+    cv = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=seed)
+    # Every model and grid point shares the per-fold scaler statistics
+    cache = FoldCache(split['X_train'], split['y_train'], cv.split(split['X_train'], split['y_train']))
+    tuned = {}
+    for name, grid in grids.items():
+        search = grid_search(base_estimator(name, estimators), grid, cache, scale=True, n_jobs=-1)
+        print(f'{name} Mean Accuracy: %.3f Config: %s' % (search['best_score'], search['best_params']))
+        tuned[name] = {'best_score': search['best_score'], 'best_params': search['best_params']}
+    return tuned
+
+
+@pipeline.stage(files=DATA_MODULES)
+def balance(load, seed=SEED):
+    """ Balancing the data by sampling, every class gets the size of class 1 """
+    data = balance_classes(load, seed)
+    print(data[TARGET].value_counts())
+    return data
+
+
+@pipeline.stage(files=DATA_MODULES)
+def select(load, k=7, test_size=0.3, seed=SEED):
+    """ Chi2 Feature Selection on the balanced training rows.
+
+    The raw rows are split first and only the training rows are oversampled, so no copy of a
+    holdout row is trained on.
+    """
+    import numpy as np
+    import pandas as pd
+    from sklearn.feature_selection import SelectKBest, chi2
+    from sklearn.model_selection import train_test_split
+
+    X = load.drop(TARGET, axis=1)
+    y = load[TARGET].values
+    train, test = train_test_split(np.arange(len(load)), test_size=test_size, random_state=seed, stratify=y)
+    balanced = train[balanced_indices(y[train], seed)]
+    best = SelectKBest(score_func=chi2, k=k).fit(X.values[balanced], y[balanced])
+    columns = list(X.columns[best.get_support()])
+    print(f'chi2 selected predictors : {columns}')
+    return {'scores': pd.Series(best.scores_, index=X.columns), 'columns': columns, 'k': k,
+            'train': train, 'test': test}
+
+
+@pipeline.stage(files=CV_MODULES + [module_path('prediction_store')], helpers=[base_estimator] + REPORT_HELPERS)
+def compare(load, select, tune, models=('LR', 'LDA', 'KNN', 'SVM', 'BCL', 'RFCL', 'ETCL'),
+            n_splits=13, n_repeats=3, seed=SEED, report_dir=REPORT_DIR, estimators=ESTIMATORS):
+    """ Cross-validation and prediction accuracy of the tuned models on the chi2 predictors.
+
+    Only the training rows of every fold are oversampled, the held-out rows keep the survey's class
+    mix. Chi2 selection and scaling are refitted on the training rows of every fold, once per fold
+    for all models. The models are scaled like the data ``tune`` searched their parameters on.
+    The out-of-fold predictions and probabilities of every model are kept in a ``PredictionStore``,
+    also saved to ``oof_predictions.npz``, for ``evaluate`` to compute its metrics without refitting.
+    """
+    import numpy as np
+    import pandas as pd
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import RepeatedStratifiedKFold
+    from fold_cache import FoldCache, cross_val_predictions
+    from prediction_store import PredictionStore
+
+    X = load.drop(TARGET, axis=1).values
+    y = load[TARGET].values
+    train, test, k = select['train'], select['test'], select['k']
+    kfold = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=seed)
+    cache = FoldCache(X[train], y[train], balanced_splits(kfold.split(X[train], y[train]), y[train], seed))
+    store = PredictionStore.from_cache(cache)
+    X_train, X_test, y_train, y_test = FoldCache(X, y, balanced_splits([(train, test)], y, seed)).fold(0, k)
+
+    summary, cv_results = [], {}
+    for name in models:
+        model = base_estimator(name, estimators)
+        if name in tune:
+            model.set_params(**tune[name]['best_params'])
+        if 'probability' in model.get_params():
+            # Platt scaling refits SVC internally, only worth it where the probabilities are kept
+            model.set_params(probability=True)
+        folds = cross_val_predictions(model, cache, k=k)
+        store.add(name, folds)
+        cv_results[name] = np.array([np.mean(y_hat == cache.y[test])
+                                     for (y_hat, _), (_, test) in zip(folds, cache.splits)])
+        fitted = model.fit(X_train, y_train)
+        y_hat = fitted.predict(X_test)
+        summary.append({'model': name, 'prediction_accuracy': accuracy_score(y_test, y_hat)})
+        prediction_report(name, y_test, y_hat)
+
+    for row in summary:
+        scores = cv_results[row['model']]
+        row.update(training_accuracy=scores.mean(), training_std=scores.std())
+        print(f"{row['model']} Training Accuracy ({scores.mean()}) STD ({scores.std()})")
+
+    os.makedirs(report_dir, exist_ok=True)
+    store.save(os.path.join(report_dir, 'oof_predictions.npz'))
+    plot_style()
+    comparison_figure(list(cv_results.values()), list(models), report_dir, 'algorithm_comparison.png')
+    return {'summary': pd.DataFrame(summary), 'cv_results': cv_results, 'store': store}
+
+
+@pipeline.stage(files=[module_path('evaluation')])
+def evaluate(compare, metric='accuracy', report_dir=REPORT_DIR):
+    """ Ranking of the compared models from their out-of-fold predictions, nothing is refitted.
+
+    Accuracy, balanced accuracy, recall of each class and log loss per fold, mean rank of every
+    model on ``metric``, Friedman test and corrected resampled t-tests between every pair.
+    """
+    from evaluation import print_report, report
+
+    summary, pairwise, friedman_test = report(compare['store'], metric)
+    print_report(summary, pairwise, friedman_test, metric)
+    os.makedirs(report_dir, exist_ok=True)
+    summary.to_csv(os.path.join(report_dir, 'model_ranking.csv'), index_label='model')
+    pairwise.to_csv(os.path.join(report_dir, f'pairwise_{metric}_p_values.csv'))
+    return {'summary': summary, 'pairwise': pairwise, 'friedman': friedman_test}
+
+
+@pipeline.stage(files=CV_MODULES + [module_path('encoding')], helpers=[base_estimator] + REPORT_HELPERS)
+def encoded(load, select, tune, models=('LR', 'LDA', 'KNN', 'SVM', 'LSVC'), n_splits=13, n_repeats=3,
+            seed=SEED, report_dir=REPORT_DIR, estimators=ESTIMATORS):
+    """ Linear and distance-based models with the categorical predictors one-hot encoded.
+
+    The education, occupation and standard of living codes are replaced by one indicator per code
+    (see ``encoding.py``), only the other predictors are scaled. As in ``compare``, only the training
+    rows of every fold are oversampled, chi2 ranks the nine predictors on them, and all the columns
+    of the ``k`` best are kept.
+    """
+    import numpy as np
+    import pandas as pd
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import RepeatedStratifiedKFold
+    from encoding import CATEGORICAL, decoding_weights, encode
+    from fold_cache import FoldCache, cross_val_scores
+
+    columns = list(load.drop(TARGET, axis=1).columns)
+    X, names = encode(load[columns].values, columns, CATEGORICAL, sparse=False)
+    scaled = np.array([name in columns for name in names])
+    decoding = decoding_weights(columns, CATEGORICAL)
+    y = load[TARGET].values
+    train, test, k = select['train'], select['test'], select['k']
+    print(f'Encoded predictors : {len(names)} columns, {int((~scaled).sum())} one-hot indicators')
+    kfold = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=seed)
+    cache = FoldCache(X[train], y[train], balanced_splits(kfold.split(X[train], y[train]), y[train], seed),
+                      scaled=scaled, decoding=decoding)
+    holdout = FoldCache(X, y, balanced_splits([(train, test)], y, seed), scaled=scaled, decoding=decoding)
+    X_train, X_test, y_train, y_test = holdout.fold(0, k)
+
+    results = []
+    summary, cv_results = [], {}
+    for name in models:
+        model = base_estimator(name, estimators)
+        if name in tune:
+            model.set_params(**tune[name]['best_params'])
+        cv_results = cross_val_scores(model, cache, k=k)
+        results.append(cv_results)
+        y_hat = model.fit(X_train, y_train).predict(X_test)
+        print(f"{name} (one-hot) Training Accuracy ({cv_results.mean()}) STD ({cv_results.std()})")
+        prediction_report(name, y_test, y_hat)
+        summary.append({
+            'model': name, 'training_accuracy': cv_results.mean(), 'training_std': cv_results.std(),
+            'prediction_accuracy': accuracy_score(y_test, y_hat),
+        })
+
+    plot_style()
+    comparison_figure(results, list(models), report_dir, 'encoded_comparison.png')
+    return {'summary': pd.DataFrame(summary), 'cv_results': dict(zip(models, results)), 'columns': names}
+
+
+@pipeline.stage(helpers=[prediction_report])
+def final_fit(balance, n_splits=16, test_size=0.3, seed=SEED):
+    """ RandomForestClassifier on the first seven predictors of the balanced data """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import KFold, cross_val_score, train_test_split
+
+    X_balanced = balance[FEATURES].values
+    y_balanced = balance[TARGET].values
+    X_train, X_test, y_train, y_test = train_test_split(X_balanced, y_balanced, test_size=test_size, random_state=seed)
+
+    model = RandomForestClassifier(random_state=seed)
+    cv_results = cross_val_score(model, X_train, y_train, cv=KFold(n_splits=n_splits), scoring='accuracy')
+    model_rfcl = model.fit(X_train, y_train)
+    y_hat = model_rfcl.predict(X_test)
+
+    print(f"RFCL Training Accuracy ({cv_results.mean()}) STD ({cv_results.std()})")
+    prediction_report('RFCL', y_test, y_hat)
+    return {'model': model_rfcl, 'cv_results': cv_results, 'prediction_accuracy': accuracy_score(y_test, y_hat)}
+
+
+@pipeline.stage(cache=False)
+def export(final_fit, model_filename=MODEL_PATH):
+    """ Save the model for reuse purposes """
+    import joblib
+
+    joblib.dump(final_fit['model'], model_filename)
+    print(f'Model saved to {model_filename}')
+    return model_filename
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Contraceptive method choice training pipeline')
+    parser.add_argument('targets', nargs='*', help='stages to bring up to date, all by default')
+    parser.add_argument('--force', nargs='+', default=[], choices=list(pipeline.stages),
+                        help='rerun these stages and everything downstream of them')
+    parser.add_argument('--workers', type=int, default=3, help='stages run concurrently')
+    parser.add_argument('--list', action='store_true', help='show the stages and whether they are cached')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.targets if name not in pipeline.stages]
+    if unknown:
+        parser.error(f'unknown stages {unknown}, choose from {list(pipeline.stages)}')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.list:
+        to_run = pipeline.plan(args.targets or None, args.force)
+        for name, stage in pipeline.stages.items():
+            state = 'will run' if name in to_run else 'cached'
+            print(f"{name:<10} <- {', '.join(stage.inputs) or '-':<25} {state}")
+    else:
+        pipeline.run(args.targets or None, force=args.force, workers=args.workers)
@@ -0,0 +1,204 @@
+"""Drift and data-quality monitoring of the scoring traffic.
+
+Every predictor is binned on its ``cmc.names`` domain: one bin per code for the
+categorical and binary attributes, fixed-width bins for ``wife_age`` and
+``number_children_ever_born``. The histograms live in fixed-size NumPy arrays:
+
+    reference   counts of the training data
+    buckets     ring of ``n_buckets`` partial histograms of the live traffic
+    window      sum of the buckets, the last ``n_buckets * bucket_rows`` rows
+
+Updating costs O(1) per row, a bincount into the current bucket and the
+window. When a bucket fills up the oldest one is subtracted from the window and
+reset, and the window is compared with the reference through the population
+stability index (PSI) and a chi2 test of homogeneity. Columns over the
+thresholds are logged as warnings. Out-of-domain values are counted apart, per
+bucket like the histograms, and reported as a data-quality issue.
+
+The monitor has a single writer and no lock: ``serve.py`` updates it from its
+event loop, readers only look at the arrays.
+
+Usage (offline check of a new file against cmc.data)
+    python drift.py new_wave.csv
+"""
+import argparse
+import logging
+
+import numpy as np
+
+from cmc_data import DATA_PATH, DOMAINS, FEATURES, headers
+
+logger = logging.getLogger(__name__)
+
+# column -> (first value, bin width, number of bins), values beyond the ends go to the edge bins
+BINNING = {
+    'wife_age': (15, 5, 8),
+    'number_children_ever_born': (0, 1, 13),
+}
+for _name, (_low, _high) in DOMAINS.items():
+    if _name not in BINNING:
+        BINNING[_name] = (_low, 1, _high - _low + 1)
+
+PSI_THRESHOLD = 0.2
+# Every column is tested at every bucket rotation, hence a much lower level than the EDA ALPHA
+ALPHA = 0.001
+EPSILON = 1e-4
+
+
+class Binner:
+    """ Vectorized mapping of coded rows to flat (column, bin) indices """
+
+    def __init__(self, columns=FEATURES):
+        self.columns = list(columns)
+        binning = np.array([BINNING[name] for name in self.columns])
+        self.offsets, self.widths, self.n_bins = binning.T
+        self.max_bins = int(self.n_bins.max())
+        self.low = np.array([DOMAINS[name][0] for name in self.columns])
+        self.high = np.array([np.inf if DOMAINS[name][1] is None else DOMAINS[name][1] for name in self.columns])
+
+    @property
+    def size(self):
+        return len(self.columns) * self.max_bins
+
+    def flat_bins(self, X):
+        bins = np.clip((X - self.offsets) // self.widths, 0, self.n_bins - 1)
+        return (np.arange(len(self.columns)) * self.max_bins + bins).ravel()
+
+    def histogram(self, X):
+        """ Counts of ``X`` as a (columns, max_bins) array """
+        X = np.asarray(X, dtype=np.int64).reshape(-1, len(self.columns))
+        return np.bincount(self.flat_bins(X), minlength=self.size).reshape(len(self.columns), self.max_bins)
+
+    def out_of_domain(self, X):
+        """ Per-column count of values outside the ``cmc.names`` domain """
+        return ((X < self.low) | (X > self.high)).sum(axis=0)
+
+
+def psi(reference, current):
+    """ Population stability index of each row of two (columns, bins) count arrays """
+    p = reference / np.maximum(reference.sum(axis=1, keepdims=True), 1) + EPSILON
+    q = current / np.maximum(current.sum(axis=1, keepdims=True), 1) + EPSILON
+    return ((q - p) * np.log(q / p)).sum(axis=1)
+
+
+def chi2_homogeneity(reference, current):
+    """ chi2 statistics and p-values of the test that ``reference`` and ``current`` come from one distribution.
+
+    Each row of the two (columns, bins) count arrays gives a 2 x bins contingency
+    table. The reference is a sample too, so its counts are not taken as the
+    exact proportions, which would make any large enough window look drifted.
+    """
+    from scipy.special import chdtrc
+
+    table = np.stack([reference, current]).astype(np.float64)
+    bin_totals = table.sum(axis=0)
+    expected = table.sum(axis=2, keepdims=True) * bin_totals / np.maximum(bin_totals.sum(axis=1, keepdims=True), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(expected > 0, (table - expected) ** 2 / expected, 0)
+    statistics = terms.sum(axis=(0, 2))
+    return statistics, chdtrc(np.maximum((bin_totals > 0).sum(axis=1) - 1, 1), statistics)
+
+
+class DriftMonitor:
+    """ Sliding-window histograms of the live traffic compared with the training ones """
+
+    def __init__(self, reference, columns=FEATURES, bucket_rows=1000, n_buckets=10,
+                 psi_threshold=PSI_THRESHOLD, alpha=ALPHA):
+        self.binner = Binner(columns)
+        self.reference = np.asarray(reference)
+        self.bucket_rows = bucket_rows
+        self.psi_threshold = psi_threshold
+        self.alpha = alpha
+        self.buckets = np.zeros((n_buckets,) + self.reference.shape, dtype=np.int64)
+        self.window = np.zeros(self.reference.shape, dtype=np.int64)
+        self.bucket_fill = np.zeros(n_buckets, dtype=np.int64)
+        self.current = 0
+        self.bucket_out_of_domain = np.zeros((n_buckets, len(self.binner.columns)), dtype=np.int64)
+        self.out_of_domain = np.zeros(len(self.binner.columns), dtype=np.int64)
+        self.last_report = None
+
+    @classmethod
+    def from_training(cls, X, columns=FEATURES, **kwargs):
+        return cls(Binner(columns).histogram(X), columns, **kwargs)
+
+    @property
+    def window_rows(self):
+        return int(self.bucket_fill.sum())
+
+    def update(self, X):
+        """ Add scored rows (n, columns) to the window, checking drift on each full bucket """
+        X = np.asarray(X, dtype=np.int64).reshape(-1, len(self.binner.columns))
+        start = 0
+        while start < len(X):
+            take = min(len(X) - start, self.bucket_rows - self.bucket_fill[self.current])
+            counts = self.binner.histogram(X[start:start + take])
+            self.buckets[self.current] += counts
+            self.window += counts
+            out_of_domain = self.binner.out_of_domain(X[start:start + take])
+            self.bucket_out_of_domain[self.current] += out_of_domain
+            self.out_of_domain += out_of_domain
+            self.bucket_fill[self.current] += take
+            start += take
+            if self.bucket_fill[self.current] == self.bucket_rows:
+                self._rotate()
+
+    def _rotate(self):
+        self.last_report = self.check()
+        self.current = (self.current + 1) % len(self.buckets)
+        self.window -= self.buckets[self.current]
+        self.buckets[self.current] = 0
+        self.out_of_domain -= self.bucket_out_of_domain[self.current]
+        self.bucket_out_of_domain[self.current] = 0
+        self.bucket_fill[self.current] = 0
+
+    def check(self):
+        """ PSI and chi2 per column over the current window, alerts are logged.
+
+        Out-of-domain values are reported over the window and logged for the
+        current bucket only, so each one is logged once.
+        """
+        statistics, p_values = chi2_homogeneity(self.reference, self.window)
+        report = {
+            'rows': self.window_rows,
+            'psi': dict(zip(self.binner.columns, psi(self.reference, self.window))),
+            'chi2': dict(zip(self.binner.columns, statistics)),
+            'p_value': dict(zip(self.binner.columns, p_values)),
+            'out_of_domain': dict(zip(self.binner.columns, self.out_of_domain.tolist())),
+        }
+        report['alerts'] = [
+            name for name in self.binner.columns
+            if report['psi'][name] > self.psi_threshold or report['p_value'][name] < self.alpha
+        ]
+        for name in report['alerts']:
+            logger.warning('Drift on %s over the last %d rows: PSI %.3f, chi2 %.1f (p=%.2g)',
+                           name, report['rows'], report['psi'][name], report['chi2'][name],
+                           report['p_value'][name])
+        for name, count in zip(self.binner.columns, self.bucket_out_of_domain[self.current].tolist()):
+            if count:
+                logger.warning('%d values of %s outside the cmc.names domain in the last %d rows',
+                               count, name, self.bucket_fill[self.current])
+        return report
+
+
+def load_coded(path, columns=FEATURES):
+    """ ``columns`` of a headerless file in the ``cmc.data`` layout, read with NumPy only """
+    data = np.loadtxt(path, delimiter=',', dtype=np.int64, ndmin=2)
+    return data[:, [headers.index(name) for name in columns]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare a scoring file with the training distribution')
+    parser.add_argument('input', help='headerless CSV in the cmc.data layout')
+    parser.add_argument('--reference', default=DATA_PATH)
+    parser.add_argument('--columns', nargs='+', default=headers[:9], choices=headers[:9])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    X = load_coded(args.input, args.columns)
+    monitor = DriftMonitor.from_training(load_coded(args.reference, args.columns), args.columns,
+                                         bucket_rows=len(X))
+    monitor.update(X)
+    report = monitor.last_report
+    for name in args.columns:
+        print(f"{name:<28} PSI {report['psi'][name]:7.3f}  chi2 {report['chi2'][name]:9.1f}  p {report['p_value'][name]:.3g}")
+    print(f"Alerts : {report['alerts'] or 'none'}")
@@ -0,0 +1,87 @@
+"""Encoding of the categorical predictors from their known ``cmc.names`` domains.
+
+``wife_education``, ``husband_education``, ``husband_occupation`` and
+``standard_living`` are codes, not quantities, so scaling them as continuous
+values misleads the linear and distance-based models. Their domains are small
+and known in advance, so no fitting is needed to one-hot encode them: every
+row has exactly one indicator per column, and the flat indices of the ones are
+computed for the whole array in one vectorized pass. They come out as a CSR
+matrix (for sparse-aware solvers such as ``LogisticRegression(solver='saga')``,
+``LinearSVC`` or ``SVC``) or as a dense ``uint8`` block.
+
+The encoded columns are linear in the codes: ``decoding_weights`` maps them back,
+so per-fold chi2 selection can still rank the original predictors (see
+``FoldCache``).
+"""
+import numpy as np
+from scipy import sparse as sp
+
+from cmc_data import DOMAINS, headers
+
+CATEGORICAL = ['wife_education', 'husband_education', 'husband_occupation', 'standard_living']
+
+
+def _domains(columns):
+    lows = np.array([DOMAINS[name][0] for name in columns])
+    sizes = np.array([DOMAINS[name][1] - DOMAINS[name][0] + 1 for name in columns])
+    return lows, sizes, np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+
+def _codes(X, columns, lows, sizes):
+    codes = np.asarray(X, dtype=np.int64).reshape(-1, len(columns)) - lows
+    bad = (codes < 0) | (codes >= sizes)
+    if bad.any():
+        name = columns[int(np.argmax(bad.any(axis=0)))]
+        raise ValueError(f'{name} has values outside its cmc.names domain {DOMAINS[name]}')
+    return codes
+
+
+def one_hot_names(columns=CATEGORICAL):
+    return [f'{name}_{value}' for name in columns
+            for value in range(DOMAINS[name][0], DOMAINS[name][1] + 1)]
+
+
+def one_hot(X, columns=CATEGORICAL, sparse=True):
+    """ One-hot encoding of the (n, len(columns)) codes ``X``, CSR or dense uint8 """
+    lows, sizes, offsets = _domains(columns)
+    codes = _codes(X, columns, lows, sizes)
+    n_rows, width = len(codes), int(sizes.sum())
+    indices = (codes + offsets).ravel()
+    if sparse:
+        indptr = np.arange(0, n_rows * len(columns) + 1, len(columns))
+        return sp.csr_matrix((np.ones(len(indices), dtype=np.uint8), indices, indptr), shape=(n_rows, width))
+    block = np.zeros((n_rows, width), dtype=np.uint8)
+    block[np.repeat(np.arange(n_rows), len(columns)), indices] = 1
+    return block
+
+
+def encode(X, columns=headers[:9], categorical=CATEGORICAL, sparse=True):
+    """ One-hot block of the ``categorical`` columns of ``X`` followed by the other columns.
+
+    Returns the encoded matrix and its column names. The dense output is float64,
+    the one-hot block only takes uint8 when returned on its own by ``one_hot``.
+    """
+    columns = list(columns)
+    categorical = [name for name in columns if name in categorical]
+    others = [name for name in columns if name not in categorical]
+    X = np.asarray(X)
+    block = one_hot(X[:, [columns.index(name) for name in categorical]], categorical, sparse)
+    rest = X[:, [columns.index(name) for name in others]].astype(np.float64)
+    names = one_hot_names(categorical) + others
+    if sparse:
+        return sp.hstack([block, sp.csr_matrix(rest)], format='csr'), names
+    return np.hstack([block, rest]), names
+
+
+def decoding_weights(columns=headers[:9], categorical=CATEGORICAL):
+    """ (encoded columns, columns) matrix W such that ``encode(X, columns, categorical)[0] @ W == X`` """
+    columns = list(columns)
+    categorical = [name for name in columns if name in categorical]
+    others = [name for name in columns if name not in categorical]
+    lows, sizes, _ = _domains(categorical)
+    source = np.repeat([columns.index(name) for name in categorical], sizes)
+    values = np.concatenate([np.arange(low, low + size) for low, size in zip(lows, sizes)] + [[]])
+    weights = np.zeros((len(source) + len(others), len(columns)))
+    weights[np.arange(len(source)), source] = values
+    weights[len(source) + np.arange(len(others)), [columns.index(name) for name in others]] = 1
+    return weights
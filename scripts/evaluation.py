@@ -0,0 +1,138 @@
+"""Model comparison from cached out-of-fold predictions.
+
+Every metric, confusion matrix and model comparison is computed from the
+arrays of a ``PredictionStore`` (see ``prediction_store.py``) with bincounts
+and reductions over all folds at once, so a new metric never refits a model:
+
+    accuracy, balanced accuracy, recall of each class, log loss   per model and fold
+    ranks of the models on each fold and Friedman test             across models
+    corrected resampled t-test (Nadeau and Bengio)                 for every pair of models
+
+Usage
+    python evaluation.py reports/oof_predictions.npz --metric balanced_accuracy
+"""
+import argparse
+
+import numpy as np
+
+from cmc_data import CLASSES
+from prediction_store import PredictionStore
+
+METRICS = ('accuracy', 'balanced_accuracy', 'log_loss')
+# Metrics where lower is better, every other one is ranked descending
+LOWER_IS_BETTER = {'log_loss'}
+EPSILON = 1e-15
+
+
+def confusion(store, name=None):
+    """ Confusion matrices (models, splits, true class, predicted class), or one model's """
+    if name is not None:
+        return confusion(store)[store.models.index(name)]
+    n_models, n_classes, n_splits = len(store.models), len(store.classes), store.n_splits
+    pred = np.stack([store.predictions[model] for model in store.models]).astype(np.int64)
+    cells = (store.split * n_classes + store.y_true) * n_classes + pred
+    cells += (np.arange(n_models) * n_splits * n_classes * n_classes)[:, None]
+    counts = np.bincount(cells.ravel(), minlength=n_models * n_splits * n_classes * n_classes)
+    return counts.reshape(n_models, n_splits, n_classes, n_classes)
+
+
+def log_loss(store):
+    """ Log loss (models, splits), NaN for the models without probabilities """
+    losses = np.full((len(store.models), store.n_splits), np.nan)
+    counts = np.bincount(store.split, minlength=store.n_splits)
+    for i, name in enumerate(store.models):
+        if name in store.probabilities:
+            proba = store.probabilities[name]
+            picked = proba[np.arange(len(proba)), store.y_true] / proba.sum(axis=1)
+            total = np.bincount(store.split, -np.log(np.clip(picked, EPSILON, 1)), minlength=store.n_splits)
+            losses[i] = total / counts
+    return losses
+
+
+def fold_metrics(store):
+    """ Per-fold metrics, each a (models, splits) array, and the per-class recall (models, splits, classes) """
+    matrices = confusion(store)
+    correct = np.diagonal(matrices, axis1=2, axis2=3)
+    support = matrices.sum(axis=3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = correct / support
+    metrics = {
+        'accuracy': correct.sum(axis=2) / support.sum(axis=2),
+        'balanced_accuracy': np.nanmean(recall, axis=2),
+        'log_loss': log_loss(store),
+    }
+    return metrics, recall
+
+
+def ranks(scores, lower_is_better=False):
+    """ Rank of every model (row) on every fold (column), 1 is the best, ties share the average rank """
+    from scipy.stats import rankdata
+
+    return rankdata(scores if lower_is_better else -scores, axis=0)
+
+
+def friedman(fold_ranks):
+    """ Friedman chi2 statistic and p-value of the (models, splits) ranks """
+    from scipy.special import chdtrc
+
+    n_models, n_splits = fold_ranks.shape
+    mean_ranks = fold_ranks.mean(axis=1)
+    statistic = 12 * n_splits / (n_models * (n_models + 1)) * ((mean_ranks ** 2).sum() - n_models * (n_models + 1) ** 2 / 4)
+    return statistic, chdtrc(n_models - 1, statistic)
+
+
+def corrected_t_tests(scores, n_train, n_test):
+    """ Nadeau and Bengio corrected resampled t-test of every pair of models.
+
+    Folds of repeated cross-validation share training rows, so the variance of
+    the score differences is inflated by ``n_test / n_train``. Returns the
+    (models, models) mean differences and two-sided p-values.
+    """
+    from scipy.special import stdtr
+
+    differences = scores[:, None, :] - scores[None, :, :]
+    n_splits = scores.shape[1]
+    mean = differences.mean(axis=2)
+    variance = differences.var(axis=2, ddof=1) * (1 / n_splits + n_test / n_train)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = mean / np.sqrt(variance)
+    p_values = np.where(variance > 0, 2 * stdtr(n_splits - 1, -np.abs(t)), 1.0)
+    return mean, p_values
+
+
+def report(store, metric='accuracy'):
+    """ Summary (one row per model, best first) and the pairwise p-values on ``metric`` """
+    import pandas as pd
+
+    metrics, recall = fold_metrics(store)
+    scores = metrics[metric]
+    fold_ranks = ranks(scores, metric in LOWER_IS_BETTER)
+    summary = pd.DataFrame({name: values.mean(axis=1) for name, values in metrics.items()}, index=store.models)
+    summary[f'{metric}_std'] = scores.std(axis=1)
+    for j, label in enumerate(store.classes):
+        summary[f'recall_{CLASSES.get(int(label), label)}'] = recall[:, :, j].mean(axis=1)
+    summary['mean_rank'] = fold_ranks.mean(axis=1)
+    statistic, p_value = friedman(fold_ranks)
+    n_test = np.bincount(store.split, minlength=store.n_splits).mean()
+    _, p_values = corrected_t_tests(scores, store.n_train.mean(), n_test)
+    pairwise = pd.DataFrame(p_values, index=store.models, columns=store.models)
+    return summary.sort_values('mean_rank'), pairwise, (statistic, p_value)
+
+
+def print_report(summary, pairwise, friedman_test, metric='accuracy'):
+    import pandas as pd
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.precision', 4):
+        print(summary)
+        print(f'Friedman test on the {metric} ranks: chi2 {friedman_test[0]:.2f} (p={friedman_test[1]:.3g})')
+        print(f'Corrected resampled t-test p-values on {metric}')
+        print(pairwise.loc[summary.index, summary.index])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ranking report from saved out-of-fold predictions')
+    parser.add_argument('store', help='.npz written by the compare stage')
+    parser.add_argument('--metric', default='accuracy', choices=METRICS)
+    args = parser.parse_args()
+    summary, pairwise, friedman_test = report(PredictionStore.load(args.store), args.metric)
+    print_report(summary, pairwise, friedman_test, args.metric)
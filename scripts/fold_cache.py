@@ -0,0 +1,268 @@
+"""Leak-free cross-validation with preprocessing shared across models and grid points.
+
+Fitting ``StandardScaler`` and ``SelectKBest(chi2)`` on the full dataset before
+splitting leaks the test rows into the training scores. Wrapping them in a
+``Pipeline`` fixes that but refits both transformers for every fold of every
+model and grid point.
+
+``FoldCache`` fits them once per split instead. The chi2 scores come from
+sufficient statistics, the column sums and per-class column sums of each test
+block: when the train part of a split is the complement of its test part, the
+train statistics are the dataset totals minus the test block, so the selection
+costs O(n_test * p) rather than a pass over the training rows. The scaler is
+fitted on the selected training columns with StandardScaler's own two-pass
+variance. The chi2 scores and scaler parameters are the ones ``chi2`` and
+``StandardScaler`` would produce on the training rows, and the transformed fold
+arrays are memoized, so every model and grid point evaluated on the cache
+reuses them.
+
+    cache = FoldCache(X_train, y_train, RepeatedStratifiedKFold(...).split(X_train, y_train))
+    search = grid_search(SVC(), {'C': [1, 10]}, cache, k=7, scale=True)
+    scores = cross_val_scores(LogisticRegression(), cache, k=7)
+    folds = cross_val_predictions(LogisticRegression(), cache, k=7)
+
+With more than one job, the data goes to the workers once as a shared
+memory-mapped array (see ``parallel.py``) and each task only carries its fold
+indices and the cached scaler parameters.
+"""
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.special import chdtrc
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid
+
+from parallel import call_limited, shared_arrays, single_job, worker_limits
+
+
+class Statistics:
+    """ Sufficient statistics of a block of rows, enough to fit StandardScaler and chi2 """
+
+    def __init__(self, n, sums, squares, class_counts, class_sums):
+        self.n = n
+        self.sums = sums
+        self.squares = squares
+        self.class_counts = class_counts
+        self.class_sums = class_sums
+
+    @classmethod
+    def of(cls, X, Y):
+        """ Statistics of rows ``X`` with one-hot labels ``Y`` """
+        return cls(len(X), X.sum(axis=0), np.einsum('ij,ij->j', X, X), Y.sum(axis=0), Y.T @ X)
+
+    @classmethod
+    def of_labels(cls, X, y, classes):
+        X = np.asarray(X, dtype=np.float64)
+        return cls.of(X, (np.asarray(y)[:, None] == np.asarray(classes)[None, :]).astype(np.float64))
+
+    def __add__(self, other):
+        return Statistics(self.n + other.n, self.sums + other.sums, self.squares + other.squares,
+                          self.class_counts + other.class_counts, self.class_sums + other.class_sums)
+
+    def __sub__(self, other):
+        return Statistics(self.n - other.n, self.sums - other.sums, self.squares - other.squares,
+                          self.class_counts - other.class_counts, self.class_sums - other.class_sums)
+
+    def scaler(self, columns=None):
+        """ ``mean_`` and ``scale_`` of a StandardScaler fitted on the rows """
+        columns = slice(None) if columns is None else columns
+        mean = self.sums[columns] / self.n
+        var = np.maximum(self.squares[columns] / self.n - mean ** 2, 0)
+        scale = np.sqrt(var)
+        scale[scale == 0] = 1.0
+        return mean, scale
+
+    def project(self, weights):
+        """ Statistics of ``X @ weights`` as far as chi2 needs them, the squares are not linear """
+        return Statistics(self.n, self.sums @ weights, None, self.class_counts, self.class_sums @ weights)
+
+    def chi2(self):
+        """ chi2 scores and p-values of every column on the rows """
+        # Classes missing from the rows are left out, as LabelBinarizer would
+        present = self.class_counts > 0
+        observed = self.class_sums[present]
+        expected = np.outer(self.class_counts[present] / self.n, observed.sum(axis=0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = ((observed - expected) ** 2 / expected).sum(axis=0)
+        return scores, chdtrc(len(observed) - 1, scores)
+
+    def selected(self, k):
+        """ Indices of the ``k`` best chi2 columns, as SelectKBest would keep them """
+        if k is None or k == 'all' or k >= len(self.sums):
+            return np.arange(len(self.sums))
+        scores, _ = self.chi2()
+        scores = np.where(np.isnan(scores), np.finfo(scores.dtype).min, scores)
+        return np.sort(np.argsort(scores, kind='mergesort')[-k:])
+
+
+class FoldCache:
+    """ Per-split scaler and chi2 statistics and memoized fold arrays.
+
+    ``splits`` is any iterable of (train, test) index arrays, such as the output
+    of a scikit-learn cross-validator's ``split``. Training indices may repeat,
+    as in the oversampled splits of ``cmc_data.balanced_splits``: the transformers
+    and models are then fitted on the repeated rows. ``scaled`` is a boolean mask of
+    the columns the scaler applies to, the others (one-hot indicators for
+    instance) are passed through as they are. When the columns of ``X`` encode
+    other predictors linearly, ``decoding`` is the (columns, predictors) matrix
+    mapping them back: the chi2 selection then ranks the predictors and keeps
+    every column derived from the ``k`` best.
+    """
+
+    def __init__(self, X, y, splits, scaled=None, decoding=None):
+        self.X = np.asarray(X, dtype=np.float64)
+        self.scaled = None if scaled is None else np.asarray(scaled, dtype=bool)
+        self.decoding = None if decoding is None else np.asarray(decoding, dtype=np.float64)
+        self.y = np.asarray(y)
+        self.classes, y_codes = np.unique(self.y, return_inverse=True)
+        self.Y = np.eye(len(self.classes))[y_codes.reshape(-1)]
+        self.splits = [(np.asarray(train), np.asarray(test)) for train, test in splits]
+        self._total = Statistics.of(self.X, self.Y)
+        self._statistics = {}
+        self._folds = {}
+
+    def __len__(self):
+        return len(self.splits)
+
+    def statistics(self, i):
+        """ Statistics of the training rows of split ``i`` """
+        if i not in self._statistics:
+            train, test = self.splits[i]
+            if len(test) < len(train) and self._is_complement(train, test):
+                stats = self._total - Statistics.of(self.X[test], self.Y[test])
+            else:
+                stats = Statistics.of(self.X[train], self.Y[train])
+            self._statistics[i] = stats
+        return self._statistics[i]
+
+    def _is_complement(self, train, test):
+        """ Whether train and test cover every row once, oversampled training rows do not """
+        if len(train) + len(test) != len(self.X):
+            return False
+        return bool((np.bincount(np.concatenate([train, test]), minlength=len(self.X)) == 1).all())
+
+    def scaler(self, i, columns=None):
+        """ ``mean_`` and ``scale_`` of a StandardScaler fitted on the training rows.
+
+        The variance is computed in two passes over the training columns, as
+        StandardScaler does: the one-pass E[x^2] - mean^2 of ``Statistics.scaler``
+        differs in the last bits, enough to flip distance ties between rows.
+        """
+        train, _ = self.splits[i]
+        columns = np.arange(self.X.shape[1]) if columns is None else columns
+        X = _rows_columns(self.X, train, columns)
+        mean = X.sum(axis=0) / len(X)
+        deviations = X - mean
+        var = ((deviations ** 2).sum(axis=0) - deviations.sum(axis=0) ** 2 / len(X)) / len(X)
+        scale = np.sqrt(var)
+        scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0
+        if self.scaled is not None:
+            kept = self.scaled if columns is None else self.scaled[columns]
+            mean, scale = np.where(kept, mean, 0.0), np.where(kept, scale, 1.0)
+        return mean, scale
+
+    def chi2(self, i):
+        """ chi2 scores and p-values of every column on the training rows """
+        return self.statistics(i).chi2()
+
+    def selected(self, i, k):
+        """ Indices of the ``k`` best chi2 columns of the training rows """
+        if self.decoding is None:
+            return self.statistics(i).selected(k)
+        predictors = self.statistics(i).project(self.decoding).selected(k)
+        return np.flatnonzero(self.decoding[:, predictors].any(axis=1))
+
+    def fold_spec(self, i, k=None, scale=True):
+        """ (train, test, columns, mean, scale) needed to rebuild split ``i`` from the raw arrays """
+        train, test = self.splits[i]
+        columns = self.selected(i, k)
+        mean, scale_ = self.scaler(i, columns) if scale else (None, None)
+        return train, test, columns, mean, scale_
+
+    def fold(self, i, k=None, scale=True):
+        """ (X_train, X_test, y_train, y_test) of split ``i`` after selection and scaling """
+        key = (i, k, scale)
+        if key not in self._folds:
+            train, test = self.splits[i]
+            columns = self.selected(i, k)
+            X_train = _rows_columns(self.X, train, columns)
+            X_test = _rows_columns(self.X, test, columns)
+            if scale:
+                mean, scale_ = self.scaler(i, columns)
+                X_train = (X_train - mean) / scale_
+                X_test = (X_test - mean) / scale_
+            self._folds[key] = (X_train, X_test, self.y[train], self.y[test])
+        return self._folds[key]
+
+
+def _rows_columns(X, rows, columns):
+    """ ``X[rows][:, columns]``, laid out (Fortran order) as SelectKBest leaves it in a Pipeline.
+
+    The layout changes the summation order of the distance computations, and so
+    which of two tied neighbours KNN picks.
+    """
+    return X[rows][:, columns]
+
+
+def _fit_and_score(estimator, X_train, X_test, y_train, y_test):
+    return np.mean(estimator.fit(X_train, y_train).predict(X_test) == y_test)
+
+
+def _fit_and_predict(estimator, X_train, X_test, y_train, y_test):
+    """ Predicted classes of the test rows and their probabilities, None without ``predict_proba`` """
+    fitted = estimator.fit(X_train, y_train)
+    proba = fitted.predict_proba(X_test) if hasattr(fitted, 'predict_proba') else None
+    return fitted.predict(X_test), proba
+
+
+def _fit_shared(function, estimator, X, y, spec):
+    """ Worker side of ``_evaluate``, rebuilds the fold from the shared arrays """
+    train, test, columns, mean, scale = spec
+    X_train = _rows_columns(X, train, columns)
+    X_test = _rows_columns(X, test, columns)
+    if mean is not None:
+        X_train = (X_train - mean) / scale
+        X_test = (X_test - mean) / scale
+    return function(estimator, X_train, X_test, y[train], y[test])
+
+
+def _evaluate(estimators, cache, k, scale, n_jobs, function=_fit_and_score):
+    """ ``function`` of every estimator on every split, a list of lists estimators x splits """
+    splits = range(len(cache))
+    n_workers, blas_threads = worker_limits(n_jobs)
+    if n_workers == 1:
+        return [[function(estimator, *cache.fold(i, k, scale)) for i in splits] for estimator in estimators]
+    specs = [cache.fold_spec(i, k, scale) for i in splits]
+    with shared_arrays(cache.X, cache.y) as (X, y):
+        results = Parallel(n_jobs=n_workers)(
+            delayed(call_limited)(_fit_shared, blas_threads, function, single_job(estimator), X, y, spec)
+            for estimator in estimators for spec in specs
+        )
+    return [results[i:i + len(specs)] for i in range(0, len(results), len(specs))]
+
+
+def cross_val_scores(estimator, cache, k=None, scale=True, n_jobs=None):
+    """ Accuracy of ``estimator`` on every split of ``cache`` """
+    return np.array(_evaluate([clone(estimator)], cache, k, scale, n_jobs)[0])
+
+
+def cross_val_predictions(estimator, cache, k=None, scale=True, n_jobs=None):
+    """ (predictions, probabilities) of ``estimator`` on the test rows of every split of ``cache`` """
+    return _evaluate([clone(estimator)], cache, k, scale, n_jobs, _fit_and_predict)[0]
+
+
+def grid_search(estimator, grid, cache, k=None, scale=True, n_jobs=None):
+    """ Mean cross-validated accuracy of every point of ``grid`` on the cached folds.
+
+    Returns a dict with ``best_score``, ``best_params``, and the ``params`` and
+    ``scores`` (points x splits) of the whole grid.
+    """
+    candidates = list(ParameterGrid(grid))
+    estimators = [clone(estimator).set_params(**params) for params in candidates]
+    scores = np.array(_evaluate(estimators, cache, k, scale, n_jobs))
+    best = int(np.argmax(scores.mean(axis=1)))
+    return {
+        'best_score': scores[best].mean(),
+        'best_params': candidates[best],
+        'params': candidates,
+        'scores': scores,
+    }
@@ -0,0 +1,75 @@
+"""Local load generator for ``serve.py``.
+
+Replays rows of ``cmc.data`` against the /predict route from a fixed number of
+concurrent clients and reports throughput, latency percentiles, how many
+requests were shed with 429 and how many connections failed.
+
+Usage
+    python load_test.py --url http://127.0.0.1:8000/predict --requests 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import time
+
+import numpy as np
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.iostream import StreamClosedError
+
+from cmc_data import DATA_PATH, FEATURES, headers
+
+
+def load_payloads(path=DATA_PATH):
+    with open(path) as f:
+        rows = [dict(zip(headers, map(int, line))) for line in csv.reader(f) if line]
+    return [json.dumps({name: row[name] for name in FEATURES}) for row in rows]
+
+
+async def client(http, url, payloads, n_requests, latencies, statuses):
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        try:
+            response = await http.fetch(url, method='POST', body=random.choice(payloads))
+            code = response.code
+        except HTTPClientError as error:
+            code = error.code
+        except (StreamClosedError, OSError):
+            # Connections reset or refused by an overloaded server are part of the result
+            code = 'connection error'
+        latencies.append(time.perf_counter() - start)
+        statuses[code] = statuses.get(code, 0) + 1
+
+
+async def main(args):
+    payloads = load_payloads()
+    AsyncHTTPClient.configure(None, max_clients=args.concurrency)
+    http = AsyncHTTPClient()
+    latencies, statuses = [], {}
+    per_client, remainder = divmod(args.requests, args.concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(http, args.url, payloads, per_client + (i < remainder), latencies, statuses)
+        for i in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    ok = statuses.get(200, 0)
+    print(f'Requests {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s, {ok / elapsed:.0f} ok/s)')
+    print(f'Status codes {dict(sorted(statuses.items(), key=lambda item: str(item[0])))}')
+    print('Latency ms  p50 %.2f  p95 %.2f  p99 %.2f  max %.2f' % tuple(
+        np.percentile(latencies, [50, 95, 99, 100])
+    ))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/predict')
+    parser.add_argument('--requests', type=int, default=10_000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,54 @@
+"""Parallel execution helpers for cross-validation and grid searches.
+
+``shared_arrays`` dumps the training arrays once to a memory-mapped file that
+every loky worker opens read-only. joblib then sends the workers a reference
+to the file instead of pickling a copy of the arrays with each task, and tasks
+only carry fold indices.
+
+``worker_limits`` splits the cores between the outer workers and whatever each
+task runs inside: estimators that have their own ``n_jobs`` (KNN, forests) are
+set to one job, and the BLAS/OpenMP pools of each worker are capped through
+threadpoolctl so the workers do not oversubscribe the machine.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import joblib
+from joblib import effective_n_jobs
+from threadpoolctl import threadpool_limits
+
+
+@contextmanager
+def shared_arrays(*arrays, temp_folder=None):
+    """ Read-only memory-mapped copies of ``arrays``, removed on exit """
+    folder = tempfile.mkdtemp(prefix='cmc_shared_', dir=temp_folder)
+    try:
+        shared = []
+        for i, array in enumerate(arrays):
+            path = os.path.join(folder, f'array_{i}.joblib')
+            joblib.dump(array, path)
+            shared.append(joblib.load(path, mmap_mode='r'))
+        yield shared
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def single_job(estimator):
+    """ Set every ``n_jobs`` parameter of ``estimator`` asking for parallelism, nested ones included, to 1 """
+    params = {name: 1 for name, value in estimator.get_params(deep=True).items()
+              if (name == 'n_jobs' or name.endswith('__n_jobs')) and value not in (None, 1)}
+    return estimator.set_params(**params) if params else estimator
+
+
+def worker_limits(n_jobs):
+    """ Number of outer workers and BLAS threads each of them may use """
+    n_workers = effective_n_jobs(n_jobs)
+    return n_workers, max(1, (os.cpu_count() or 1) // n_workers)
+
+
+def call_limited(function, blas_threads, *args):
+    """ Run ``function(*args)`` with the native thread pools capped at ``blas_threads`` """
+    with threadpool_limits(limits=blas_threads):
+        return function(*args)
@@ -0,0 +1,191 @@
+"""Small DAG runner with on-disk memoization of stage outputs.
+
+A stage is a plain function registered with ``Pipeline.stage``. Its positional
+parameters without defaults name the upstream stages whose outputs it takes,
+its parameters with defaults are its configuration:
+
+    pipeline = Pipeline('.pipeline_cache')
+
+    @pipeline.stage(files=[DATA_PATH])
+    def load(filename=DATA_PATH):
+        ...
+
+    @pipeline.stage()
+    def scale(load, test_size=0.3):
+        ...
+
+The cache key of a stage hashes its name, its source code, its configuration,
+the content of the ``files`` it declares, the source of the ``helpers`` it
+calls and the keys of its inputs. A rerun only executes the stages whose key
+changed, plus everything downstream of them, and independent stages run
+concurrently on a thread pool. Nothing else a stage calls is part of its key:
+list helper functions as ``helpers``, declare the modules it imports as
+``files`` and pass the tables it reads as configuration.
+"""
+import hashlib
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import joblib
+
+
+class Stage:
+
+    def __init__(self, func, inputs, params, files=(), cache=True, helpers=()):
+        self.func = func
+        self.name = func.__name__
+        self.inputs = inputs
+        self.params = params
+        self.files = list(files)
+        self.cache = cache
+        self.helpers = list(helpers)
+
+
+def _file_digest(path, block_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Pipeline:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def stage(self, files=(), cache=True, helpers=()):
+        """ Decorator registering a function as a stage.
+
+        ``files`` and the source of the ``helpers`` functions are hashed into the
+        cache key, ``cache=False`` makes the stage run every time (for side
+        effects such as exporting an artifact).
+        """
+        def register(func):
+            inputs, params = [], {}
+            for name, parameter in inspect.signature(func).parameters.items():
+                if parameter.default is parameter.empty:
+                    inputs.append(name)
+                else:
+                    params[name] = parameter.default
+            unknown = [name for name in inputs if name not in self.stages]
+            if unknown:
+                raise ValueError(f'stage {func.__name__} depends on unknown stages {unknown}')
+            self.stages[func.__name__] = Stage(func, inputs, params, files, cache, helpers)
+            return func
+        return register
+
+    def key(self, name, _keys=None):
+        keys = {} if _keys is None else _keys
+        if name not in keys:
+            stage = self.stages[name]
+            digest = hashlib.sha256(name.encode())
+            digest.update(inspect.getsource(stage.func).encode())
+            for helper in stage.helpers:
+                digest.update(inspect.getsource(helper).encode())
+            digest.update(repr(sorted(stage.params.items())).encode())
+            for path in stage.files:
+                digest.update(_file_digest(path).encode())
+            for upstream in stage.inputs:
+                digest.update(self.key(upstream, keys).encode())
+            keys[name] = digest.hexdigest()
+        return keys[name]
+
+    def _path(self, name, key):
+        return os.path.join(self.cache_dir, f'{name}-{key[:16]}.joblib')
+
+    def is_cached(self, name):
+        stage = self.stages[name]
+        return stage.cache and os.path.exists(self._path(name, self.key(name)))
+
+    def load(self, name):
+        """ Output of a stage from the cache """
+        return joblib.load(self._path(name, self.key(name)))
+
+    def _store(self, name, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(name, key)
+        tmp = f'{path}.tmp{threading.get_ident()}'
+        joblib.dump(value, tmp)
+        os.replace(tmp, path)
+        # Drop outputs of earlier versions of the stage
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(f'{name}-') and entry.endswith('.joblib') and entry != os.path.basename(path):
+                os.remove(os.path.join(self.cache_dir, entry))
+
+    def plan(self, targets=None, force=()):
+        """ Stages that must run, in registration (topological) order """
+        targets = list(self.stages) if targets is None else list(targets)
+        forced = set()
+        for name, stage in self.stages.items():
+            if name in force or forced.intersection(stage.inputs):
+                forced.add(name)
+
+        to_run = set()
+
+        def visit(name):
+            if name in to_run:
+                return
+            if name not in forced and self.is_cached(name):
+                return
+            to_run.add(name)
+            for upstream in self.stages[name].inputs:
+                visit(upstream)
+
+        for name in targets:
+            visit(name)
+        return [name for name in self.stages if name in to_run]
+
+    def run(self, targets=None, force=(), workers=4):
+        """ Execute the stages needed for ``targets`` and return their names """
+        to_run = self.plan(targets, force)
+        keys = {}
+        values = {}
+
+        def value(name):
+            with self._lock:
+                if name not in values:
+                    values[name] = self.load(name)
+                return values[name]
+
+        def execute(name):
+            stage = self.stages[name]
+            args = [value(upstream) for upstream in stage.inputs]
+            start = time.perf_counter()
+            print(f'[{name}] running')
+            result = stage.func(*args, **stage.params)
+            if stage.cache:
+                self._store(name, self.key(name, keys), result)
+            print(f'[{name}] done in {time.perf_counter() - start:.1f}s')
+            return result
+
+        for name in self.stages:
+            if name not in to_run and (targets is None or name in targets):
+                print(f'[{name}] cached')
+
+        pending = list(to_run)
+        running = {}
+        with ThreadPoolExecutor(workers) as executor:
+            while pending or running:
+                for name in list(pending):
+                    if not any(upstream in pending or upstream in running.values()
+                               for upstream in self.stages[name].inputs):
+                        pending.remove(name)
+                        running[executor.submit(execute, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BaseException:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    with self._lock:
+                        values[name] = result
+        return to_run
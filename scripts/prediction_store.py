@@ -0,0 +1,72 @@
+"""Out-of-fold predictions of the compared models, in a columnar layout.
+
+``PredictionStore`` keeps what the cross-validation of every compared model
+predicted, in arrays shared by all the models:
+
+    split, row, y_true        one entry per out-of-fold prediction, common to the models
+    n_train                   distinct training rows of each split
+    pred__<model>             predicted class codes (int8)
+    proba__<model>            class probabilities (float32), absent without predict_proba
+
+It is saved as a single ``.npz``. The metrics are computed from it in
+``evaluation.py``, which the ``compare`` stage does not depend on: a new metric
+reruns ``evaluate`` only.
+"""
+import numpy as np
+
+
+class PredictionStore:
+    """ Out-of-fold predictions and probabilities of several models on the same splits """
+
+    def __init__(self, classes, split, row, y_true, n_train):
+        self.classes = np.asarray(classes)
+        self.split = np.asarray(split, dtype=np.int32)
+        self.row = np.asarray(row, dtype=np.int32)
+        self.y_true = np.asarray(y_true, dtype=np.int8)
+        self.n_train = np.asarray(n_train, dtype=np.int32)
+        self.predictions = {}
+        self.probabilities = {}
+
+    @classmethod
+    def from_cache(cls, cache):
+        """ Empty store laid out on the test rows of the splits of a ``FoldCache``.
+
+        Oversampled training rows are counted once in ``n_train``, the t-test correction is about
+        the rows the folds share, not their copies.
+        """
+        tests = [test for _, test in cache.splits]
+        row = np.concatenate(tests)
+        return cls(cache.classes, np.repeat(np.arange(len(tests)), [len(test) for test in tests]), row,
+                   np.searchsorted(cache.classes, cache.y[row]), [len(np.unique(train)) for train, _ in cache.splits])
+
+    @property
+    def models(self):
+        return list(self.predictions)
+
+    @property
+    def n_splits(self):
+        return len(self.n_train)
+
+    def add(self, name, folds):
+        """ Record the (predictions, probabilities) of every split, as ``cross_val_predictions`` returns them """
+        self.predictions[name] = np.searchsorted(self.classes, np.concatenate([y_hat for y_hat, _ in folds])).astype(np.int8)
+        if all(proba is not None for _, proba in folds):
+            self.probabilities[name] = np.vstack([proba for _, proba in folds]).astype(np.float32)
+
+    def save(self, path):
+        arrays = {'classes': self.classes, 'split': self.split, 'row': self.row, 'y_true': self.y_true,
+                  'n_train': self.n_train}
+        arrays.update({f'pred__{name}': pred for name, pred in self.predictions.items()})
+        arrays.update({f'proba__{name}': proba for name, proba in self.probabilities.items()})
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            store = cls(data['classes'], data['split'], data['row'], data['y_true'], data['n_train'])
+            for key in data.files:
+                if key.startswith('pred__'):
+                    store.predictions[key[len('pred__'):]] = data[key]
+                elif key.startswith('proba__'):
+                    store.probabilities[key[len('proba__'):]] = data[key]
+        return store
@@ -0,0 +1,257 @@
+"""Incremental refresh of the finalized RandomForestClassifier with a new survey wave.
+
+A full retrain rereads ``cmc.data``, rebalances, reselects and refits every
+tree. A refresh only touches the new rows:
+
+1. the scaler and chi2 sufficient statistics are updated by adding those of
+   the new rows (see ``fold_cache.Statistics``), and the chi2 ranking is
+   reported so a change in the selected predictors can trigger a full retrain,
+2. a copy of the forest grows ``--trees`` new trees with ``warm_start``,
+   fitted on the balanced new rows minus a stratified holdout,
+3. the oldest trees beyond ``--max-trees`` are retired, so the forest is a
+   sliding window over the waves,
+4. the refreshed forest is scored against the current one on the holdout and
+   replaces the model artifact atomically (``os.replace``) only if it is not
+   worse by more than ``--tolerance``,
+5. the rows are appended to the cached dataset (``rows.bin``, append-only)
+   and the statistics and tree waves are saved.
+
+Nothing is written before the refreshed forest is built, so a wave that fails
+can be fixed and appended again. Before the swap the wave and its rows are
+recorded as pending, and the swapped forest carries its tree waves
+(``refresh_waves_``): a run interrupted between the swap and the state save is
+finished on the next load if the model holds the pending wave, and the pending
+wave is dropped otherwise. Rows appended to ``rows.bin`` by an interrupted run
+but not counted in the saved statistics are dropped on the next load.
+
+Usage
+    python refresh.py init                       # seed the state from cmc.data and the saved model
+    python refresh.py append new_wave.csv --trees 25 --max-trees 200
+"""
+import argparse
+import copy
+import json
+import os
+
+import joblib
+import numpy as np
+
+from cmc_data import DATA_PATH, DOMAINS, HERE, MODEL_PATH, SEED, headers
+from fold_cache import Statistics
+
+STATE_DIR = os.path.join(HERE, '.refresh')
+CLASSES = np.array([1, 2, 3])
+
+
+class RefreshState:
+    """ Cached dataset, its sufficient statistics and the wave each tree was trained on """
+
+    def __init__(self, state_dir=STATE_DIR):
+        self.state_dir = state_dir
+        self.rows_path = os.path.join(state_dir, 'rows.bin')
+        self.statistics_path = os.path.join(state_dir, 'statistics.joblib')
+        self.trees_path = os.path.join(state_dir, 'trees.json')
+        self.pending_path = os.path.join(state_dir, 'pending.joblib')
+
+    def exists(self):
+        return os.path.exists(self.trees_path)
+
+    def rows(self):
+        """ The cached dataset, memory-mapped """
+        return np.memmap(self.rows_path, dtype=np.int64, mode='r').reshape(-1, len(headers))
+
+    def append_rows(self, rows):
+        with open(self.rows_path, 'ab') as f:
+            np.ascontiguousarray(rows, dtype=np.int64).tofile(f)
+
+    def load(self, model_path=MODEL_PATH):
+        with open(self.trees_path) as f:
+            trees = json.load(f)
+        statistics = joblib.load(self.statistics_path)
+        recorded = statistics.n * len(headers) * np.dtype(np.int64).itemsize
+        if os.path.getsize(self.rows_path) > recorded:
+            os.truncate(self.rows_path, recorded)
+        if os.path.exists(self.pending_path):
+            return self.reconcile(statistics, trees['waves'], trees['last_wave'], model_path)
+        return statistics, trees['waves'], trees['last_wave']
+
+    def save(self, statistics, waves, last_wave):
+        os.makedirs(self.state_dir, exist_ok=True)
+        atomic_dump(statistics, self.statistics_path)
+        atomic_write_json(self.trees_path, {'waves': waves, 'last_wave': last_wave})
+
+    def begin(self, wave, rows, waves):
+        """ Record the wave about to be swapped into the model, with its rows and the new tree waves """
+        atomic_dump({'wave': wave, 'rows': rows, 'waves': waves}, self.pending_path)
+
+    def commit(self, statistics, rows, waves, last_wave):
+        """ Append the wave's rows, save the state and clear the pending wave """
+        self.append_rows(rows)
+        self.save(statistics, waves, last_wave)
+        if os.path.exists(self.pending_path):
+            os.remove(self.pending_path)
+
+    def reconcile(self, statistics, waves, last_wave, model_path=MODEL_PATH):
+        """ Finish the pending wave if the model was swapped before the state was saved, else drop it """
+        pending = joblib.load(self.pending_path)
+        if pending['wave'] in getattr(joblib.load(model_path), 'refresh_waves_', ()):
+            statistics = statistics + statistics_of(pending['rows'])
+            waves, last_wave = pending['waves'], pending['wave']
+            self.commit(statistics, pending['rows'], waves, last_wave)
+            print(f'Wave {last_wave} was swapped into {model_path} by an interrupted run, its state is saved now')
+        else:
+            os.remove(self.pending_path)
+        return statistics, waves, last_wave
+
+
+def atomic_write_json(path, value):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+def atomic_dump(value, path):
+    """ Write the artifact next to ``path`` and swap it in, readers never see a partial file """
+    tmp = f'{path}.tmp'
+    joblib.dump(value, tmp)
+    os.replace(tmp, path)
+
+
+def read_wave(path):
+    rows = np.loadtxt(path, delimiter=',', dtype=np.int64, ndmin=2)
+    if rows.shape[1] != len(headers):
+        raise ValueError(f'{path} has {rows.shape[1]} columns, expected the {len(headers)} of cmc.data')
+    for i, name in enumerate(headers):
+        low, high = DOMAINS[name]
+        bad = (rows[:, i] < low) | ((rows[:, i] > high) if high is not None else False)
+        if bad.any():
+            raise ValueError(f'{int(bad.sum())} values of {name} outside the cmc.names domain')
+    return rows
+
+
+def statistics_of(rows):
+    return Statistics.of_labels(rows[:, :-1], rows[:, -1], CLASSES)
+
+
+def init(state, model_path=MODEL_PATH, data_path=DATA_PATH):
+    rows = read_wave(data_path)
+    model = joblib.load(model_path)
+    os.makedirs(state.state_dir, exist_ok=True)
+    if os.path.exists(state.rows_path):
+        os.remove(state.rows_path)
+    state.append_rows(rows)
+    state.save(statistics_of(rows), [0] * len(model.estimators_), 0)
+    print(f'Refresh state seeded with {len(rows)} rows and {len(model.estimators_)} trees in {state.state_dir}')
+
+
+def check_classes(y, holdout_size=0.2, minimum=2):
+    """ Every class needs rows on both sides of the holdout split, and each side a row per class """
+    counts = np.array([(y == label).sum() for label in CLASSES])
+    short = CLASSES[counts < minimum]
+    if len(short):
+        raise ValueError(f'the new wave has fewer than {minimum} rows of classes {short.tolist()}, its trees '
+                         'could not vote for them: gather a larger wave or run a full retrain')
+    # train_test_split rounds the holdout up and stratifies both sides
+    n_holdout = int(np.ceil(len(y) * holdout_size))
+    if min(n_holdout, len(y) - n_holdout) < len(CLASSES):
+        raise ValueError(f'a {holdout_size:g} holdout of the {len(y)} new rows leaves {n_holdout} holdout and '
+                         f'{len(y) - n_holdout} training rows, each side needs one row per class: gather a '
+                         'larger wave or change --holdout-size')
+
+
+def grow(model, X, y, n_trees):
+    """ Copy of ``model`` with ``n_trees`` more trees fitted on (X, y) only """
+    missing = set(model.classes_) - set(np.unique(y))
+    if missing:
+        raise ValueError(f'the new wave has no rows of classes {sorted(missing)}, its trees could not '
+                         'vote for them: gather a larger wave or run a full retrain')
+    grown = copy.deepcopy(model)
+    grown.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_trees)
+    return grown.fit(X, y)
+
+
+def retire(model, waves, max_trees):
+    """ Drop the oldest trees beyond ``max_trees`` """
+    excess = len(model.estimators_) - max_trees
+    if excess > 0:
+        model.estimators_ = model.estimators_[excess:]
+        model.set_params(n_estimators=len(model.estimators_))
+        waves = waves[excess:]
+    return model, waves
+
+
+def append(state, wave_path, model_path=MODEL_PATH, n_trees=20, max_trees=200, holdout_size=0.2,
+           tolerance=0.01, k=7, seed=SEED):
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from cmc_data import FEATURES, TARGET, balance_classes
+
+    statistics, waves, last_wave = state.load(model_path)
+    rows = read_wave(wave_path)
+    check_classes(rows[:, -1], holdout_size)
+    before = list(statistics.selected(k))
+
+    statistics = statistics + statistics_of(rows)
+    wave = last_wave + 1
+    after = list(statistics.selected(k))
+    print(f'Wave {wave}: {len(rows)} new rows, {statistics.n} with the cached ones')
+    print(f'chi2 top {k} predictors : {[headers[i] for i in after]}')
+    if after != before:
+        print('The chi2 selection changed, a full retrain is advised')
+
+    train, holdout = train_test_split(rows, test_size=holdout_size, random_state=seed, stratify=rows[:, -1])
+    balanced = balance_classes(pd.DataFrame(train, columns=headers), seed)
+    X_new, y_new = balanced[FEATURES].values, balanced[TARGET].values
+
+    model = joblib.load(model_path)
+    assert len(waves) == len(model.estimators_), \
+        f'{len(waves)} tree waves recorded for the {len(model.estimators_)} trees of {model_path}'
+    refreshed = grow(model, X_new, y_new, n_trees)
+    refreshed, refreshed_waves = retire(refreshed, waves + [wave] * n_trees, max_trees)
+
+    X_holdout, y_holdout = holdout[:, [headers.index(name) for name in FEATURES]], holdout[:, -1]
+    current_accuracy = model.score(X_holdout, y_holdout)
+    refreshed_accuracy = refreshed.score(X_holdout, y_holdout)
+    print(f'Holdout accuracy : current {current_accuracy:.4f}, refreshed {refreshed_accuracy:.4f} '
+          f'({len(refreshed.estimators_)} trees, waves {sorted(set(refreshed_waves))})')
+
+    accepted = refreshed_accuracy + tolerance >= current_accuracy
+    if accepted:
+        refreshed.refresh_waves_ = refreshed_waves
+        state.begin(wave, rows, refreshed_waves)
+        atomic_dump(refreshed, model_path)
+        print(f'Refreshed model swapped into {model_path}')
+    else:
+        print(f'Refreshed model rejected, {model_path} unchanged')
+    state.commit(statistics, rows, refreshed_waves if accepted else waves, wave)
+    return accepted
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--state-dir', default=STATE_DIR)
+    parser.add_argument('--model', default=MODEL_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    seed = commands.add_parser('init', help='seed the refresh state from cmc.data and the saved model')
+    seed.add_argument('--data', default=DATA_PATH)
+    wave = commands.add_parser('append', help='refresh the model with a new wave')
+    wave.add_argument('wave', help='headerless CSV in the cmc.data layout, target included')
+    wave.add_argument('--trees', type=int, default=20, help='trees grown on the new wave')
+    wave.add_argument('--max-trees', type=int, default=200, help='oldest trees beyond this are retired')
+    wave.add_argument('--holdout-size', type=float, default=0.2)
+    wave.add_argument('--tolerance', type=float, default=0.01,
+                      help='largest holdout accuracy loss accepted for the swap')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    state = RefreshState(args.state_dir)
+    if args.command == 'init':
+        init(state, args.model, args.data)
+    else:
+        if not state.exists():
+            raise SystemExit(f'No refresh state in {args.state_dir}, run "python refresh.py init" first')
+        append(state, args.wave, args.model, n_trees=args.trees, max_trees=args.max_trees,
+               holdout_size=args.holdout_size, tolerance=args.tolerance)
@@ -0,0 +1,153 @@
+"""Bulk offline scoring of survey files with the finalized RandomForestClassifier.
+
+The input is streamed in chunks instead of being loaded whole. Each chunk keeps
+the seven predictors the model was fitted on (the ``X_balanced`` columns) and is
+scored on a process pool. At most ``2 * workers`` chunks are in flight, and
+results are written in input order as soon as the head chunk is done, so memory
+stays bounded by the chunk size whatever the file size.
+
+Input and output formats are picked from the file extension (``.csv``/``.data``
+or ``.parquet``). Parquet needs pyarrow.
+
+Usage
+    python score_batch.py households.csv predictions.parquet --chunksize 500000 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cmc_data import FEATURES, MODEL_PATH, headers
+from scoring import load_model, predict
+
+
+def _is_parquet(path):
+    return os.path.splitext(path)[1].lower() in ('.parquet', '.pq')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit('Reading or writing Parquet files requires pyarrow: pip install pyarrow')
+    return pyarrow
+
+
+def read_chunks(path, chunksize, has_header=False):
+    """ Yield DataFrames of at most ``chunksize`` rows from a CSV or Parquet file """
+    if _is_parquet(path):
+        pyarrow = _import_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+        names = None if has_header else headers
+        yield from pd.read_csv(path, names=names, chunksize=chunksize)
+
+
+class ChunkWriter:
+    """ Appends scored chunks to a CSV or Parquet file """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = _is_parquet(path)
+        self._writer = None
+        self._first = True
+
+    def write(self, frame):
+        if self.parquet:
+            pyarrow = _import_pyarrow()
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self._first else 'a', header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def feature_block(chunk, offset):
+    missing = [name for name in FEATURES if name not in chunk.columns]
+    if missing:
+        raise ValueError(f'input is missing columns {missing}')
+    X = chunk[FEATURES]
+    if X.isnull().values.any():
+        raise ValueError(f'missing values in rows {offset} to {offset + len(chunk) - 1}')
+    return X.to_numpy(dtype=np.int64)
+
+
+def with_predictions(chunk, classes, predicted, proba):
+    chunk = chunk.copy()
+    chunk['predicted_method'] = predicted
+    for i, label in enumerate(classes):
+        chunk[f'probability_{int(label)}'] = proba[:, i]
+    return chunk
+
+
+def score_file(input_path, output_path, model_path=MODEL_PATH, chunksize=100_000, workers=None,
+               has_header=False):
+    """ Score ``input_path`` chunk by chunk and write predictions to ``output_path``.
+
+    Returns the number of rows scored.
+    """
+    classes = load_model(model_path).classes_
+    workers = workers or os.cpu_count()
+    writer = ChunkWriter(output_path)
+    pending = deque()
+    n_rows = 0
+    start = time.perf_counter()
+
+    def flush_head():
+        nonlocal n_rows
+        chunk, future = pending.popleft()
+        predicted, proba = future.result()
+        writer.write(with_predictions(chunk, classes, predicted, proba))
+        n_rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f'{n_rows} rows scored ({n_rows / elapsed:.0f} rows/s)', file=sys.stderr)
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=load_model, initargs=(model_path,)) as executor:
+            offset = 0
+            for chunk in read_chunks(input_path, chunksize, has_header):
+                X = feature_block(chunk, offset)
+                offset += len(chunk)
+                pending.append((chunk, executor.submit(predict, X)))
+                # Bound the number of chunks held in memory, in order
+                if len(pending) >= 2 * workers:
+                    flush_head()
+            while pending:
+                flush_head()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f'Scored {n_rows} rows in {elapsed:.2f}s ({n_rows / max(elapsed, 1e-9):.0f} rows/s) -> {output_path}')
+    return n_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='CSV (cmc.data layout) or Parquet file to score')
+    parser.add_argument('output', help='destination .csv or .parquet file')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=None, help='process pool size, defaults to the CPU count')
+    parser.add_argument('--header', action='store_true',
+                        help='the CSV input has a header row instead of the cmc.data column order')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    score_file(args.input, args.output, model_path=args.model, chunksize=args.chunksize,
+               workers=args.workers, has_header=args.header)
@@ -0,0 +1,26 @@
+"""Model runtime shared by the serving and batch scoring entry points.
+
+Only NumPy and joblib are imported here. Unpickling the model pulls in the
+sklearn modules it needs, nothing else from the training side is loaded.
+"""
+import joblib
+import numpy as np
+
+_model = None
+
+
+def load_model(path):
+    """ Load the model into this process, also used as a pool initializer """
+    global _model
+    _model = joblib.load(path)
+    return _model
+
+
+def predict_proba(X):
+    return _model.predict_proba(X)
+
+
+def predict(X):
+    """ Predicted classes and class probabilities of the loaded model """
+    proba = _model.predict_proba(X)
+    return _model.classes_[np.argmax(proba, axis=1)], proba
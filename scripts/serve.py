@@ -0,0 +1,252 @@
+"""Asyncio HTTP scoring endpoint for the finalized RandomForestClassifier.
+
+Requests are validated against the ``cmc.names`` domains, queued and coalesced
+into micro-batches. Each batch is scored with a single ``predict_proba`` call
+in a thread or process pool so the event loop never blocks on the model. The
+queue is bounded: when it is full the endpoint answers 429 instead of letting
+latency grow without limit. Scored rows also feed a ``DriftMonitor`` whose
+per-feature PSI and alerts are exported as gauges.
+
+Routes
+    POST /predict   JSON object with the seven predictor fields
+    GET  /metrics   Prometheus text format (latency and batch size histograms)
+    GET  /health
+
+Usage
+    python serve.py --model finalized_model_rfcl.sav --port 8000
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import tornado.web
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+
+from cmc_data import CLASSES, DATA_PATH, MODEL_PATH, validate_record
+from drift import DriftMonitor, load_coded
+from scoring import load_model, predict_proba
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+class Metrics:
+    """ Prometheus collectors for the scoring endpoint """
+
+    def __init__(self):
+        self.registry = CollectorRegistry()
+        self.latency = Histogram(
+            'cmc_request_latency_seconds', 'Time from request arrival to response',
+            buckets=LATENCY_BUCKETS, registry=self.registry,
+        )
+        self.batch_latency = Histogram(
+            'cmc_batch_latency_seconds', 'Time spent in predict_proba per micro-batch',
+            buckets=LATENCY_BUCKETS, registry=self.registry,
+        )
+        self.batch_size = Histogram(
+            'cmc_batch_size', 'Requests coalesced per micro-batch',
+            buckets=BATCH_BUCKETS, registry=self.registry,
+        )
+        self.queue_depth = Gauge('cmc_queue_depth', 'Requests waiting to be scored', registry=self.registry)
+        self.rejected = Counter('cmc_rejected_total', 'Requests answered with 429', registry=self.registry)
+        self.invalid = Counter('cmc_invalid_total', 'Requests answered with 400', registry=self.registry)
+        self.psi = Gauge('cmc_feature_psi', 'PSI of the scoring window against the training data',
+                         ['feature'], registry=self.registry)
+        self.drift = Gauge('cmc_feature_drift', '1 when the feature is drifting', ['feature'], registry=self.registry)
+
+    def observe_drift(self, report):
+        for name, value in report['psi'].items():
+            self.psi.labels(name).set(value)
+            self.drift.labels(name).set(name in report['alerts'])
+
+
+class MicroBatcher:
+    """ Coalesces single-row requests into batches scored in an executor.
+
+    A batch is flushed as soon as it holds ``max_batch_size`` rows or ``max_delay``
+    seconds after its first row arrived, whichever comes first. Identical rows in
+    a batch are scored once.
+    """
+
+    def __init__(self, executor, metrics, max_batch_size=64, max_delay=0.005, max_queue=1024, monitor=None):
+        self.executor = executor
+        self.metrics = metrics
+        self.monitor = monitor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def submit(self, row):
+        """ Queue a row and return a future for its probabilities.
+
+        Raises asyncio.QueueFull when the queue is at capacity.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((row, future))
+        self.metrics.queue_depth.set(self.queue.qsize())
+        return future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            # Drain what is already queued before waiting on the deadline
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self.metrics.queue_depth.set(self.queue.qsize())
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            rows = np.array([row for row, _ in batch], dtype=np.int64)
+            if self.monitor is not None:
+                # Runs on the event loop thread, the monitor's only writer
+                report = self.monitor.last_report
+                self.monitor.update(rows)
+                if self.monitor.last_report is not report:
+                    self.metrics.observe_drift(self.monitor.last_report)
+            unique_rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+            self.metrics.batch_size.observe(len(batch))
+            start = time.perf_counter()
+            try:
+                probabilities = await loop.run_in_executor(self.executor, predict_proba, unique_rows)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.metrics.batch_latency.observe(time.perf_counter() - start)
+            probabilities = probabilities[inverse.reshape(-1)]
+            for (_, future), proba in zip(batch, probabilities):
+                # The client may have disconnected and cancelled its future
+                if not future.done():
+                    future.set_result(proba)
+
+
+class PredictHandler(tornado.web.RequestHandler):
+
+    def initialize(self, batcher, metrics, classes):
+        self.batcher = batcher
+        self.metrics = metrics
+        self.classes = classes
+
+    async def post(self):
+        start = time.perf_counter()
+        try:
+            row = validate_record(json.loads(self.request.body))
+        except ValueError as error:
+            self.metrics.invalid.inc()
+            self.set_status(400)
+            self.finish({'error': str(error)})
+            return
+        try:
+            future = self.batcher.submit(row)
+        except asyncio.QueueFull:
+            self.metrics.rejected.inc()
+            self.set_status(429)
+            self.set_header('Retry-After', '1')
+            self.finish({'error': 'scoring queue is full, retry later'})
+            return
+        proba = await future
+        best = int(self.classes[int(np.argmax(proba))])
+        self.finish({
+            'contraceptive_method_used': best,
+            'label': CLASSES.get(best),
+            'probabilities': {str(int(c)): float(p) for c, p in zip(self.classes, proba)},
+        })
+        self.metrics.latency.observe(time.perf_counter() - start)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.finish(generate_latest(self.metrics.registry))
+
+
+class HealthHandler(tornado.web.RequestHandler):
+
+    def get(self):
+        self.finish({'status': 'ok'})
+
+
+def make_app(batcher, metrics, classes):
+    return tornado.web.Application([
+        (r'/predict', PredictHandler, dict(batcher=batcher, metrics=metrics, classes=classes)),
+        (r'/metrics', MetricsHandler, dict(metrics=metrics)),
+        (r'/health', HealthHandler),
+    ])
+
+
+def make_executor(model_path, pool, workers):
+    if pool == 'process':
+        return ProcessPoolExecutor(workers, initializer=load_model, initargs=(model_path,))
+    # Threads share the model loaded in this process, sklearn releases the GIL in tree traversal
+    load_model(model_path)
+    return ThreadPoolExecutor(workers)
+
+
+async def main(args):
+    classes = load_model(args.model).classes_
+    executor = make_executor(args.model, args.pool, args.workers)
+    metrics = Metrics()
+    monitor = None
+    if args.drift_bucket_rows:
+        monitor = DriftMonitor.from_training(
+            load_coded(args.drift_reference), bucket_rows=args.drift_bucket_rows, n_buckets=args.drift_buckets,
+        )
+    batcher = MicroBatcher(
+        executor, metrics, max_batch_size=args.max_batch_size,
+        max_delay=args.max_delay_ms / 1000, max_queue=args.max_queue, monitor=monitor,
+    )
+    app = make_app(batcher, metrics, classes)
+    app.listen(args.port, address=args.host)
+    print(f'Serving {args.model} on http://{args.host}:{args.port} ({args.pool} pool, {args.workers} workers)')
+    workers = [asyncio.ensure_future(batcher.run()) for _ in range(args.workers)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='executor workers, one batch loop is run per worker')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-delay-ms', type=float, default=5.0,
+                        help='longest time a request waits for its batch to fill')
+    parser.add_argument('--max-queue', type=int, default=1024,
+                        help='queued requests beyond this are rejected with 429')
+    parser.add_argument('--drift-reference', default=DATA_PATH, help='training data the traffic is compared with')
+    parser.add_argument('--drift-bucket-rows', type=int, default=1000,
+                        help='rows between drift checks, 0 disables drift monitoring')
+    parser.add_argument('--drift-buckets', type=int, default=10, help='buckets in the sliding window')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
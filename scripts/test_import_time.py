@@ -0,0 +1,11 @@
+"""Import-time budget of the training and scoring entry points, see ``check_import_time.py``."""
+import pytest
+
+from check_import_time import BUDGETS, measure
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time(module):
+    elapsed, loaded = measure(module)
+    assert not loaded, f'{module} loads {loaded} at import time'
+    assert elapsed <= BUDGETS[module], f'{module} imports in {elapsed * 1000:.0f} ms, budget {BUDGETS[module] * 1000:.0f} ms'
@@ -0,0 +1,240 @@
+"""Hyperparameter search for the tree models with an accuracy/latency/size objective.
+
+Each trial cross-validates a RandomForestClassifier (or DecisionTreeClassifier)
+on the training split of the raw data, then refits it and measures
+
+    accuracy   mean cross-validation accuracy
+    latency    predict_proba time per 1000 rows, in milliseconds
+    size       pickled model size, in bytes
+
+Trials are ranked on
+
+    objective = accuracy - latency_weight * log10(latency) - size_weight * log10(size)
+
+With the default weights of 0.0025, a forest ten times smaller and ten times
+faster is worth 0.5 points of accuracy. The Pareto front over the three metrics
+is reported as well, so other trade-offs can be picked by hand.
+
+The classes are oversampled inside each training fold only, and the held-out
+folds and test split keep their original rows. Oversampling before splitting
+would put copies of a row on both sides and reward forests that memorise them.
+
+Trials run in worker processes whose native thread pools are capped at one
+thread through threadpoolctl. Each worker gets an address
+space cap (``--memory-per-worker``) so one oversized forest fails on its own
+instead of taking the host down, the worker count is capped by available
+memory, trials whose estimated model size exceeds the cap are skipped, and the
+most expensive trials are scheduled first.
+
+Usage
+    python tune_trees.py --model rf --workers 8 --memory-per-worker 2048 --results rf_trials.csv
+"""
+import argparse
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import ParameterGrid, ParameterSampler, StratifiedKFold, train_test_split
+from sklearn.tree import DecisionTreeClassifier
+from threadpoolctl import threadpool_limits
+
+from cmc_data import FEATURES, SEED, TARGET, balance_classes, load_dataset
+
+SEARCH_SPACES = {
+    'rf': {
+        'n_estimators': [10, 25, 50, 100, 200],
+        'max_depth': [4, 6, 8, 12, 16, None],
+        'min_samples_leaf': [1, 2, 5, 10],
+        'max_features': ['sqrt', 0.5, None],
+    },
+    'cart': {
+        'criterion': ['entropy', 'gini'],
+        'max_depth': [4, 6, 8, 12, 16, None],
+        'min_samples_leaf': [1, 2, 5, 10],
+        'max_features': ['sqrt', 0.5, None],
+    },
+}
+
+ESTIMATORS = {'rf': RandomForestClassifier, 'cart': DecisionTreeClassifier}
+
+# Rough bytes per fitted tree node: the node record plus its per-class value array
+BYTES_PER_NODE = 64 + 8 * 3
+
+_data = None
+
+
+def _init_worker(data, memory_bytes):
+    """ Pool initializer, caps the worker address space and keeps the data """
+    global _data
+    _data = data
+    threadpool_limits(limits=1)
+    if memory_bytes:
+        try:
+            import resource
+        except ImportError:
+            # Not available on Windows, trials then run uncapped
+            pass
+        else:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+def available_memory():
+    """ MemAvailable, free memory plus the page cache the kernel can reclaim """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def balanced(X, y):
+    """ (X, y) with every class oversampled to the size of class 1, see ``balance_classes`` """
+    frame = balance_classes(pd.DataFrame(np.column_stack([X, y]), columns=FEATURES + [TARGET]))
+    return frame[FEATURES].values, frame[TARGET].values
+
+
+def estimated_nodes(params, n_samples):
+    """ Upper bound on the number of nodes of one tree """
+    by_leaves = 2 * n_samples // params.get('min_samples_leaf', 1)
+    depth = params.get('max_depth')
+    if depth is None:
+        return by_leaves
+    return min(2 ** (depth + 1), by_leaves)
+
+
+def estimated_model_bytes(params, n_samples):
+    return params.get('n_estimators', 1) * estimated_nodes(params, n_samples) * BYTES_PER_NODE
+
+
+def run_trial(kind, params, cv_splits, latency_rows=1000, repeats=5):
+    X_train, y_train, X_test, y_test = _data
+    model = ESTIMATORS[kind](random_state=SEED, **params)
+    if kind == 'rf':
+        model.set_params(n_jobs=1)
+    try:
+        kfold = StratifiedKFold(n_splits=cv_splits, shuffle=True, random_state=SEED)
+        cv_results = np.array([
+            model.fit(*balanced(X_train[train], y_train[train])).score(X_train[test], y_train[test])
+            for train, test in kfold.split(X_train, y_train)
+        ])
+        model.fit(*balanced(X_train, y_train))
+    except MemoryError:
+        return {'model': kind, **params, 'status': 'out of memory'}
+
+    X_latency = np.resize(X_test, (latency_rows, X_test.shape[1]))
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict_proba(X_latency)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'model': kind, **params, 'status': 'ok',
+        'accuracy': cv_results.mean(),
+        'accuracy_std': cv_results.std(),
+        'test_accuracy': model.score(X_test, y_test),
+        'latency_ms': 1000 * min(timings) * 1000 / latency_rows,
+        'size_bytes': len(pickle.dumps(model)),
+    }
+
+
+def objective(results, latency_weight, size_weight):
+    return (results['accuracy'] - latency_weight * np.log10(results['latency_ms'])
+            - size_weight * np.log10(results['size_bytes']))
+
+
+def pareto_front(results):
+    """ Rows not dominated on (max accuracy, min latency_ms, min size_bytes) """
+    values = results[['accuracy', 'latency_ms', 'size_bytes']].to_numpy() * np.array([-1, 1, 1])
+    no_worse = (values[:, None, :] >= values[None, :, :]).all(axis=2)
+    better = (values[:, None, :] > values[None, :, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=1)
+    return results[~dominated]
+
+
+def candidates(kind, n_iter=None):
+    space = SEARCH_SPACES[kind]
+    if n_iter:
+        return list(ParameterSampler(space, n_iter=n_iter, random_state=SEED))
+    return list(ParameterGrid(space))
+
+
+def tune(kind='rf', n_iter=None, cv_splits=5, workers=None, memory_per_worker_mb=2048,
+         latency_weight=0.0025, size_weight=0.0025):
+    data = load_dataset()
+    X_train, X_test, y_train, y_test = train_test_split(
+        data[FEATURES].values, data[TARGET].values, test_size=0.3, random_state=SEED, stratify=data[TARGET].values
+    )
+    memory_bytes = memory_per_worker_mb * 2 ** 20 if memory_per_worker_mb else None
+
+    workers = workers or os.cpu_count()
+    free = available_memory()
+    if memory_bytes and free:
+        workers = max(1, min(workers, free // memory_bytes))
+
+    # Forests are fitted on the training rows with every class oversampled to the size of class 1
+    n_fit = 3 * int((y_train == 1).sum())
+    trials, skipped = [], []
+    for params in candidates(kind, n_iter):
+        if memory_bytes and estimated_model_bytes(params, n_fit) > memory_bytes // 2:
+            skipped.append({'model': kind, **params, 'status': 'skipped, over memory cap'})
+        else:
+            trials.append(params)
+    # Longest trials first so the pool does not end on a straggler
+    trials.sort(key=lambda params: estimated_model_bytes(params, n_fit), reverse=True)
+
+    print(f'{len(trials)} {kind} trials on {workers} workers ({len(skipped)} skipped)')
+    rows = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=((X_train, y_train, X_test, y_test), memory_bytes)) as executor:
+        futures = [executor.submit(run_trial, kind, params, cv_splits) for params in trials]
+        for i, future in enumerate(as_completed(futures), 1):
+            rows.append(future.result())
+            if i % 25 == 0 or i == len(futures):
+                print(f'{i}/{len(futures)} trials done')
+
+    results = pd.DataFrame(rows + skipped)
+    ok = results['status'] == 'ok'
+    results.loc[ok, 'objective'] = objective(results[ok], latency_weight, size_weight)
+    results['pareto'] = False
+    results.loc[pareto_front(results[ok]).index, 'pareto'] = True
+    return results.sort_values('objective', ascending=False, na_position='last')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', choices=sorted(SEARCH_SPACES), default='rf')
+    parser.add_argument('--n-iter', type=int, default=None,
+                        help='sample this many configurations instead of the full grid')
+    parser.add_argument('--cv', type=int, default=5, help='cross-validation folds per trial')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--memory-per-worker', type=int, default=2048, help='MB, 0 disables the cap')
+    parser.add_argument('--latency-weight', type=float, default=0.0025)
+    parser.add_argument('--size-weight', type=float, default=0.0025)
+    parser.add_argument('--results', default=None, help='write every trial to this CSV file')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = tune(args.model, n_iter=args.n_iter, cv_splits=args.cv, workers=args.workers,
+                   memory_per_worker_mb=args.memory_per_worker,
+                   latency_weight=args.latency_weight, size_weight=args.size_weight)
+    columns = [c for c in results.columns if c not in ('model', 'status', 'pareto')]
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print('\nPareto front (accuracy, latency_ms per 1000 rows, size_bytes)')
+        print(results[results['pareto']][columns].to_string(index=False))
+        print('\nBest by objective')
+        print(results.iloc[0][columns].to_string())
+    if args.results:
+        results.to_csv(args.results, index=False)